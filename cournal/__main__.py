@@ -17,6 +17,7 @@
 # You should have received a copy of the GNU General Public License
 # along with Cournal.  If not, see <http://www.gnu.org/licenses/>.
 
+import argparse
 import os
 import sys
 import gettext
@@ -34,13 +35,19 @@ def run():
         # locale_dir = os.path.join(sys.prefix, "local", "share", "locale")
         gettext.install("cournal")  # , locale_dir)
 
+    parser = argparse.ArgumentParser(description=_("Collaborative note taking on PDF documents."))
+    parser.add_argument("--simplify", type=float, default=0, metavar="TOLERANCE",
+                        help=_("Remove unneeded points from new and imported strokes. "
+                               "Strokes will not move by more than TOLERANCE pt."))
+    args = parser.parse_args()
+
     gtk3reactor.install()
     from twisted.internet import reactor
     from cournal.mainwindow import MainWindow
 
     Gtk.IconTheme.get_default().prepend_search_path("./icons")
 
-    window = MainWindow()
+    window = MainWindow(simplify_tolerance=args.simplify)
     window.connect("destroy", lambda _: reactor.stop())
     window.show_all()
 
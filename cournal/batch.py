@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# This file is part of Cournal.
+# Copyright (C) 2012 Fabian Henze
+#
+# Cournal is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cournal is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cournal.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import gettext
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+from gi.repository import GLib, Poppler
+import cairo
+
+from cournal import __versionstring__ as cournal_version
+from cournal.document.export import PDFExport
+from cournal.document.stroke import draw_strokes
+from cournal.document import xojparser
+from cournal.server import server
+from cournal.server.oplog import OperationLog
+from cournal.viewer.renderer import render_page
+
+"""
+Render documents of cournal-server or Xournal files to PDF files or PNG
+images without user interface, using several processes.
+"""
+
+DEFAULT_RESOLUTION = 150  # dpi
+DEFAULT_PAGES_PER_JOB = 16
+
+
+class Job:
+    """
+    A part of the work, that is done by one worker process: Either a whole
+    document, that is exported as PDF, or some pages of a document, that are
+    rendered as PNG images.
+    """
+    def __init__(self, source, pdfname, output, pages=None, resolution=DEFAULT_RESOLUTION):
+        """
+        Constructor
+
+        Positional arguments:
+        source -- Filename of a .xoj file or a document saved by cournal-server
+        pdfname -- Filename of the PDF document or None to use the background
+                   named in the .xoj file
+        output -- Filename of the PDF file or prefix of the PNG files to create
+
+        Keyword arguments:
+        pages -- range of the numbers of the pages to render as PNG images or
+                 None to export a PDF file (defaults to None)
+        resolution -- Resolution of PNG images in dpi (defaults to DEFAULT_RESOLUTION)
+        """
+        self.source = source
+        self.pdfname = pdfname
+        self.output = output
+        self.pages = pages
+        self.resolution = resolution
+
+
+def load_strokes(source):
+    """
+    Load the strokes of a document.
+
+    Positional arguments:
+    source -- Filename of a .xoj file or a document saved by cournal-server
+
+    Return value: tuple of two: (filename of the background PDF or None,
+                  list of lists of Stroke objects, one list per page)
+    """
+    if source.endswith(".xoj"):
+        pdfname = None
+        pages = []
+        for pagenum, background, strokes in xojparser.iter_pages(source):
+            pdfname = pdfname or background
+            pages.append(strokes)
+        return pdfname, pages
+
+    directory, filename = os.path.split(source)
+    name = server.filename_to_docname(filename)
+    document = server.load_document(source, name)
+    # Include the changes, which were not yet written to the file
+    document.oplog = OperationLog(os.path.join(directory, server.docname_to_logname(name)))
+    document.replay_operation_log()
+    return None, [list(page.strokes.values()) for page in document.pages]
+
+
+def run_job(job):
+    """
+    Do the work of a job. Called in a worker process.
+
+    Positional arguments:
+    job -- The Job object
+
+    Return value: tuple of four: (job, number of rendered pages, time in
+                  seconds, error message or None)
+    """
+    start = time.perf_counter()
+    try:
+        pdfname, strokes = load_strokes(job.source)
+        pdfname = job.pdfname or pdfname
+        if pdfname is None:
+            raise Exception(_("No PDF document given"))
+        pdf = Poppler.Document.new_from_file(GLib.filename_to_uri(os.path.abspath(pdfname), None), None)
+        # Strokes on pages beyond the end of the PDF are ignored
+        strokes += [[]] * (pdf.get_n_pages() - len(strokes))
+
+        if job.pages is None:
+            pages = []
+            for pagenum in range(pdf.get_n_pages()):
+                width, height = pdf.get_page(pagenum).get_size()
+                pages.append((width, height, [strokes[pagenum]]))
+            errors = []
+            PDFExport(os.path.abspath(pdfname), pages, job.output, finished_callback=errors.append).run()
+            if errors[0] is not None:
+                raise Exception(errors[0])
+            num_pages = len(pages)
+        else:
+            scaling = job.resolution / 72
+            for pagenum in job.pages:
+                page = pdf.get_page(pagenum)
+                width, height = page.get_size()
+                surface = render_page(page, math.ceil(width * scaling), math.ceil(height * scaling))
+                context = cairo.Context(surface)
+                context.scale(scaling, scaling)
+                draw_strokes(context, strokes[pagenum], scaling)
+                surface.write_to_png("{}-{:04}.png".format(job.output, pagenum + 1))
+            num_pages = len(job.pages)
+    except Exception as ex:
+        return job, 0, time.perf_counter() - start, str(ex)
+    return job, num_pages, time.perf_counter() - start, None
+
+
+def find_sources(paths):
+    """
+    Return a list of the documents to render.
+
+    Positional arguments:
+    paths -- List of filenames and directories. Directories are searched for
+             .xoj files and documents saved by cournal-server.
+    """
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames = [filename for filename in os.listdir(path) if filename.endswith(".xoj")]
+            filenames += server.find_documents(path).values()
+            for filename in sorted(filenames):
+                sources.append(os.path.join(path, filename))
+        else:
+            sources.append(path)
+    return sources
+
+
+def create_jobs(sources, args):
+    """
+    Split the work into jobs. A PDF export is one job per document, PNG
+    images are rendered in jobs of args.pages_per_job pages.
+
+    Positional arguments:
+    sources -- List of filenames of the documents to render
+    args -- The parsed commandline options
+
+    Return value: List of Job objects
+    """
+    jobs = []
+    for source in sources:
+        filename = os.path.basename(source)
+        if source.endswith(".xoj"):
+            name = filename[:-4]
+        else:
+            name = server.filename_to_docname(filename)
+        output = os.path.join(args.output_directory, name.replace(os.sep, "_"))
+
+        if args.format == "pdf":
+            jobs.append(Job(source, args.pdf, output + ".pdf"))
+            continue
+
+        pdfname = args.pdf
+        if pdfname is None and source.endswith(".xoj"):
+            # Only parse the pages up to the one naming the background
+            for pagenum, background, strokes in xojparser.iter_pages(source):
+                if background is not None:
+                    pdfname = background
+                    break
+        if pdfname is None:
+            print(_("ERROR: No PDF document given for '{}'").format(source), file=sys.stderr)
+            continue
+        pdf = Poppler.Document.new_from_file(GLib.filename_to_uri(os.path.abspath(pdfname), None), None)
+        num_pages = pdf.get_n_pages()
+        for first in range(0, num_pages, args.pages_per_job):
+            pages = range(first, min(first + args.pages_per_job, num_pages))
+            jobs.append(Job(source, pdfname, output, pages, args.resolution))
+    return jobs
+
+
+def main():
+    """Render documents from the commandline"""
+    gettext.install("cournal")
+
+    parser = argparse.ArgumentParser(description=_("Render Cournal documents without user interface."),
+                                     epilog=_("e.g.: %(prog)s -p lecture.pdf ~/.cournal/documents"))
+    parser.add_argument("paths", nargs="+", metavar="PATH",
+                        help=_("A .xoj file, a document saved by cournal-server or a directory containing them"))
+    parser.add_argument("-p", "--pdf",
+                        help=_("The PDF document, which was annotated. "
+                               "Required for documents saved by cournal-server."))
+    parser.add_argument("-f", "--format", choices=["pdf", "png"], default="pdf",
+                        help=_("Create one PDF file per document or one PNG image per page"))
+    parser.add_argument("-r", "--resolution", type=int, default=DEFAULT_RESOLUTION,
+                        help=_("Resolution of PNG images in dpi"))
+    parser.add_argument("-o", "--output-directory", default=".",
+                        help=_("The directory within which to store the created files"))
+    parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(),
+                        help=_("Number of worker processes"))
+    parser.add_argument("--pages-per-job", type=int, default=DEFAULT_PAGES_PER_JOB,
+                        help=_("Number of pages rendered at once by a worker process"))
+    parser.add_argument("-v", "--version", action="version",
+                        version="%(prog)s " + cournal_version)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    jobs = create_jobs(find_sources(args.paths), args)
+    num_pages = 0
+    busy_time = 0
+    failed = 0
+    with multiprocessing.Pool(args.jobs, initializer=gettext.install, initargs=("cournal",)) as pool:
+        for job, pages, seconds, error in pool.imap_unordered(run_job, jobs):
+            busy_time += seconds
+            if error:
+                failed += 1
+                print(_("ERROR: {}: {}").format(job.source, error), file=sys.stderr)
+                continue
+            num_pages += pages
+            print(_("{}: {} pages in {:.2f} s").format(job.output, pages, seconds))
+
+    total_time = time.perf_counter() - start
+    print(_("Rendered {} pages in {} jobs with {} processes in {:.2f} s "
+            "({:.1f} pages/s, {:.2f} s of work).").format(
+                num_pages, len(jobs) - failed, args.jobs, total_time,
+                num_pages / total_time if total_time else 0, busy_time))
+    if failed:
+        print(_("{} jobs failed.").format(failed), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -17,133 +17,345 @@
 # You should have received a copy of the GNU General Public License
 # along with Cournal.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections.abc import Sequence
 from gzip import open as open_xoj
+import os
 from os.path import abspath
+from tempfile import NamedTemporaryFile
+import threading
 
 from gi.repository import Poppler, GLib
-import cairo
 
 from cournal.document.page import Page
 from cournal.document import history
 from cournal.document import search
+from cournal.document.export import PDFExport
+
+
+# Number of page sizes fetched from the PDF in one idle callback
+SIZE_BATCH = 50
+# Page size in pt, that is assumed for documents without pages
+DEFAULT_PAGE_SIZE = (595.0, 842.0)
+# Number of coordinates formatted at once, when writing .xoj files
+XOJ_WRITE_BATCH = 1024
 
 
 class Document:
     """
     A Cournal document, having multiple pages.
+
+    Page objects are created, when they are accessed for the first time. The
+    sizes of all pages are fetched from the PDF in the background. Until then,
+    the size of the first page is used as estimate.
     """
-    def __init__(self, pdfname):
+    def __init__(self, pdfname, simplify_tolerance=0):
         """
         Constructor
 
         Positional arguments:
         pdfname -- The filename of the PDF document, which will be annotated
+
+        Keyword arguments:
+        simplify_tolerance -- If greater than 0, new and imported strokes are
+                              simplified within this tolerance in pt (defaults to 0)
         """
 
         self.pdfname = abspath(pdfname)
+        self.simplify_tolerance = simplify_tolerance
         uri = GLib.filename_to_uri(self.pdfname, None)
         self.pdf = Poppler.Document.new_from_file(uri, None)
         search.set_pdf(self.pdf)
-        self.width = 0
-        self.height = 0
-        self.pages = []
+        self.num_of_pages = self.pdf.get_n_pages()
+        # (width, height) of every page in pt, or None if not yet known
+        self.page_sizes = [None] * self.num_of_pages
+        # Called without arguments, when sizes of pages became known, which
+        # differ from their estimated size
+        self.sizes_changed_callback = None
+        self.estimated_size = DEFAULT_PAGE_SIZE
+        self.pages = PageList(self, self.num_of_pages)
+        # The thread writing the last .xoj file saved in the background, if any
+        self.save_thread = None
         history.reset()
 
-        for i in range(self.pdf.get_n_pages()):
-            page = Page(self, self.pdf.get_page(i), i)
-            self.pages.append(page)
-
-            self.width = max(self.width, page.width)
-            self.height += page.height
-            self.num_of_pages = len(self.pages)
+        if self.num_of_pages > 0:
+            first = self.pages[0]
+            self.estimated_size = (first.width, first.height)
+        self._next_unsized_page = 1
+        if self.num_of_pages > 1:
+            GLib.idle_add(self._fetch_page_sizes)
 
         print(_("The document has {} pages").format(self.num_of_pages))
 
+    def get_page_size(self, pagenum):
+        """
+        Return the size of a page in pt, or an estimate, if it is not yet known.
+
+        Positional arguments:
+        pagenum -- Number of the page (starting with 0)
+
+        Return value: tuple of two: (width, height)
+        """
+        return self.page_sizes[pagenum] or self.estimated_size
+
+    def set_page_size(self, pagenum, width, height, notify=True):
+        """
+        Remember the size of a page.
+
+        Positional arguments:
+        pagenum -- Number of the page (starting with 0)
+        width, height -- Size of the page in pt
+
+        Keyword arguments:
+        notify -- Call sizes_changed_callback, if the size differs from the
+                  estimate (defaults to True)
+
+        Return value: True, if the size differs from the estimate
+        """
+        changed = self.get_page_size(pagenum) != (width, height)
+        self.page_sizes[pagenum] = (width, height)
+        if changed and notify and self.sizes_changed_callback:
+            self.sizes_changed_callback()
+        return changed
+
+    def _fetch_page_sizes(self):
+        """
+        Idle callback, which fetches the sizes of the next SIZE_BATCH pages,
+        that were not yet accessed.
+        """
+        changed = False
+        stop = min(self._next_unsized_page + SIZE_BATCH, self.num_of_pages)
+        for pagenum in range(self._next_unsized_page, stop):
+            if self.page_sizes[pagenum] is None:
+                width, height = self.pdf.get_page(pagenum).get_size()
+                changed |= self.set_page_size(pagenum, width, height, notify=False)
+        self._next_unsized_page = stop
+        if changed and self.sizes_changed_callback:
+            self.sizes_changed_callback()
+        return stop < self.num_of_pages
+
     def is_empty(self):
         """
         Returns True, if no page of this document has a stroke on it.
         Otherwise False
         """
-        for page in self.pages:
+        for page in self.pages.loaded():
             if len(page.layers[0].strokes) != 0:
                 return False
         return True
 
     def clear_pages(self):
         """Deletes all strokes on all pages of this document"""
-        for page in self.pages:
+        for page in self.pages.loaded():
             for stroke in page.layers[0].strokes[:]:
                 page.delete_stroke(stroke, send_to_network=False)
 
-    def export_pdf(self, filename):
+    def export_pdf(self, filename, in_background=False, progress_callback=None, finished_callback=None):
         """
         Save the whole document (PDF+annotations) as a PDF file.
 
         Positional arguments:
         filename -- filename of the new PDF file.
+
+        Keyword arguments:
+        in_background -- Export in a separate thread. The strokes to export
+                         are collected before this method returns.
+                         (defaults to False)
+        progress_callback -- see PDFExport (defaults to None)
+        finished_callback -- see PDFExport (defaults to None)
+
+        Return value: The PDFExport object, which can be used to cancel it
+        """
+        export = PDFExport(self.pdfname, self.get_pages_to_save(), filename,
+                           progress_callback, finished_callback)
+        if in_background:
+            export.start()
+        else:
+            export.run()
+        return export
+
+    def save_xoj_file(self, filename, in_background=False, finished_callback=None):
+        """
+        Save the whole document as a .xoj file. Saves are written one after
+        another, in the order they were requested.
+
+        Positional arguments:
+        filename -- filename of the new .xoj file
+
+        Keyword arguments:
+        in_background -- Write the file in a separate thread. The strokes to
+                         save are collected before this method returns.
+                         (defaults to False)
+        finished_callback -- Called in the main thread with an error message or
+                             None, when the file was written. Without it,
+                             errors are printed. (defaults to None)
+
+        Return value: The threading.Thread writing the file, if in_background
+                      is True, else None
         """
+        pages = self.get_pages_to_save()
+        previous = self.save_thread
+        if in_background:
+            def run():
+                if previous is not None:
+                    previous.join()
+                error = _write_xoj_file_reporting_errors(filename, self.pdfname, pages)
+                if finished_callback is not None:
+                    GLib.idle_add(finished_callback, error)
+
+            self.save_thread = threading.Thread(target=run)
+            self.save_thread.start()
+            return self.save_thread
+
+        if previous is not None:
+            previous.join()
+        error = _write_xoj_file_reporting_errors(filename, self.pdfname, pages)
+        if finished_callback is not None:
+            finished_callback(error)
+
+    def get_pages_to_save(self):
+        """
+        Collect everything to save or export, so files can be written, while
+        the document is being modified. A stroke, which is still being drawn,
+        is left out.
+
+        Return value: List of tuples of three: (width, height, list of layers,
+                      each being a list of Stroke objects)
+        """
+        pages = []
+        for pagenum in range(self.num_of_pages):
+            page = self.pages.get_loaded(pagenum)
+            if page is not None:
+                layers = [[stroke for stroke in layer.strokes if stroke is not page.unfinished_stroke]
+                          for layer in page.layers]
+                pages.append((page.width, page.height, layers))
+            else:
+                if self.page_sizes[pagenum] is None:
+                    width, height = self.pdf.get_page(pagenum).get_size()
+                    self.set_page_size(pagenum, width, height)
+                width, height = self.page_sizes[pagenum]
+                pages.append((width, height, [[]]))
+        return pages
+
+
+def _write_xoj_file_reporting_errors(filename, pdfname, pages):
+    """
+    Call write_xoj_file() and print errors.
+
+    Return value: An error message or None, if the file was written
+    """
+    try:
+        write_xoj_file(filename, pdfname, pages)
+    except (IOError, OSError) as ex:
+        print(_("Error saving document: {}").format(ex))
+        return str(ex)
+    return None
+
+
+def write_xoj_file(filename, pdfname, pages):
+    """
+    Write a .xoj file atomically. It is written page by page and stroke by
+    stroke into the compressed stream, so the whole XML document is never in
+    memory.
+
+    Positional arguments:
+    filename -- filename of the new .xoj file
+    pdfname -- filename of the PDF document
+    pages -- List of tuples of three: (width, height, list of layers, each
+             being a list of Stroke objects)
+
+    Raises IOError, if the file could not be written.
+    """
+    directory, basename = os.path.split(abspath(filename))
+    # We write to a tmpfile and move it to the actual location, so in case of
+    # a crash, either the old or the new version of that file is on the disk
+    tmpfile = NamedTemporaryFile(prefix=basename + '-', suffix='.delete-me', dir=directory, delete=False)
+    try:
+        with tmpfile, open_xoj(tmpfile, "wt", encoding="UTF-8") as f:
+            _write_xoj(f, pdfname, pages)
+        # Temporary files are only readable by their owner
         try:
-            surface = cairo.PDFSurface(filename, 0, 0)
-        except IOError as ex:
-            print(_("Error saving document: {}").format(ex))
-            # FIXME: Move error handler to mainwindow.py and show error message
-            return
+            mode = os.stat(filename).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = 0o644
+        os.chmod(tmpfile.name, mode)
+        os.rename(tmpfile.name, filename)
+    except Exception:
+        os.remove(tmpfile.name)
+        raise
+
 
-        for page in self.pages:
-            surface.set_size(page.width, page.height)
-            context = cairo.Context(surface)
+def _write_xoj(f, pdfname, pages):
+    """Write the XML of a .xoj file into the text stream f."""
+    # Thanks to Xournal's awesome XML(-not)-parsing, we can't use ElementTree here.
+    # In "Xournal World", <t a="a" b="b"> is not the same as <t b="b" a="a"> ...
+    f.write("<?xml version=\"1.0\" standalone=\"no\"?>\n")
+    f.write("<xournal version=\"0.4.6\">\n")
+    f.write("<title>Xournal document - see http://math.mit.edu/~auroux/software/xournal/</title>\n")
 
-            page.pdf.render_for_printing(context)
+    for pagenum, (width, height, layers) in enumerate(pages, 1):
+        f.write("<page width=\"{}\" height=\"{}\">\n".format(round(width, 2), round(height, 2)))
+        f.write("<background type=\"pdf\"")
+        if pagenum == 1:
+            f.write(" domain=\"absolute\" filename=\"{}\"".format(pdfname))
+        f.write(" pageno=\"{}\" />\n".format(pagenum))
 
-            for stroke in page.layers[0].strokes:
-                stroke.draw(context)
+        for strokes in layers:
+            f.write("<layer>\n")
+            for stroke in strokes:
+                red, g, b, opacity = stroke.color
+                f.write("<stroke tool=\"pen\" color=\"#{:02X}{:02X}{:02X}{:02X}\" width=\"{}\">\n".format(red, g, b, opacity, stroke.linewidth))
+                coords = stroke.coords
+                for i in range(0, len(coords), XOJ_WRITE_BATCH):
+                    f.write(" ")
+                    f.write(" ".join(map(str, coords[i:i + XOJ_WRITE_BATCH])))
+                if len(coords) < 4:
+                    f.write(" {} {}".format(coords[0], coords[1]))
+                f.write("\n</stroke>\n")
+            f.write("</layer>\n")
+        f.write("</page>\n")
+    f.write("</xournal>")
 
-            surface.show_page()  # aka "next page"
 
-    def save_xoj_file(self, filename):
+class PageList(Sequence):
+    """
+    The pages of a document. A Page object is created, when it is accessed
+    for the first time.
+    """
+    def __init__(self, document, num_pages):
         """
-        Save the whole document as a .xoj file.
+        Constructor
 
         Positional arguments:
-        filename -- filename of the new .xoj file
+        document -- The Document object, which is the parent of the pages
+        num_pages -- Number of pages of the document
         """
-        pagenum = 1
-        try:
-            f = open_xoj(filename, "wb")
-        except IOError as ex:
-            print(_("Error saving document: {}").format(ex))
-            # FIXME: Move error handler to mainwindow.py and show error message
-            return
-
-        # Thanks to Xournal's awesome XML(-not)-parsing, we can't use ElementTree here.
-        # In "Xournal World", <t a="a" b="b"> is not the same as <t b="b" a="a"> ...
-
-        r = "<?xml version=\"1.0\" standalone=\"no\"?>\n"
-        r += "<xournal version=\"0.4.6\">\n"
-        r += "<title>Xournal document - see http://math.mit.edu/~auroux/software/xournal/</title>\n"
-
-        for page in self.pages:
-            r += "<page width=\"{}\" height=\"{}\">\n".format(round(page.width, 2), round(page.height, 2))
-            r += "<background type=\"pdf\""
-            if pagenum == 1:
-                r += " domain=\"absolute\" filename=\"{}\"".format(self.pdfname)
-            r += " pageno=\"{}\" />\n".format(pagenum)
-            pagenum += 1
-
-            for layer in page.layers:
-                r += "<layer>\n"
-                for stroke in layer.strokes:
-                    red, g, b, opacity = stroke.color
-                    r += "<stroke tool=\"pen\" color=\"#{:02X}{:02X}{:02X}{:02X}\" width=\"{}\">\n".format(red, g, b, opacity, stroke.linewidth)
-                    first = stroke.coords[0]
-                    for coord in stroke.coords:
-                        r += " {} {}".format(coord[0], coord[1])
-                    if len(stroke.coords) < 2:
-                        r += " {} {}".format(first[0], first[1])
-                    r += "\n</stroke>\n"
-                r += "</layer>\n"
-                r += "</page>\n"
-        r += "</xournal>"
-
-        f.write(bytes(r, "UTF-8"))
-        f.close()
+        self.document = document
+        self._pages = [None] * num_pages
+
+    def __len__(self):
+        return len(self._pages)
+
+    def __getitem__(self, pagenum):
+        if isinstance(pagenum, slice):
+            return [self[i] for i in range(*pagenum.indices(len(self)))]
+        if pagenum < 0:
+            pagenum += len(self)
+        page = self._pages[pagenum]
+        if page is None:
+            page = Page(self.document, self.document.pdf.get_page(pagenum), pagenum)
+            self._pages[pagenum] = page
+            self.document.set_page_size(pagenum, page.width, page.height)
+        return page
+
+    def get_loaded(self, pagenum):
+        """
+        Return a page, if it was already created, else None.
+
+        Positional arguments:
+        pagenum -- Number of the page (starting with 0)
+        """
+        return self._pages[pagenum]
+
+    def loaded(self):
+        """Return a list of all pages, that were already created."""
+        return [page for page in self._pages if page is not None]
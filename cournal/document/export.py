@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# This file is part of Cournal.
+# Copyright (C) 2012 Fabian Henze
+#
+# Cournal is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cournal is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cournal.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import threading
+
+from gi.repository import GLib, Poppler
+import cairo
+
+from cournal.document.stroke import draw_strokes
+
+"""
+Export of annotated documents to PDF files.
+"""
+
+
+class PDFExport:
+    """
+    Exports a PDF document and the strokes on its pages to a new PDF file,
+    either in the calling thread or in a worker thread.
+
+    The worker uses its own Poppler.Document and only a list of the strokes
+    of every page, which is collected beforehand, so the document can be
+    modified during the export. Callbacks are always run in the thread, which
+    started the export.
+    """
+    def __init__(self, pdfname, pages, filename, progress_callback=None, finished_callback=None):
+        """
+        Constructor
+
+        Positional arguments:
+        pdfname -- The filename of the PDF document, which is annotated
+        pages -- List of tuples of three: (width, height, list of layers, each
+                 being a list of Stroke objects)
+        filename -- filename of the new PDF file
+
+        Keyword arguments:
+        progress_callback -- Called with the number of exported pages and the
+                             number of all pages after each page (defaults to None)
+        finished_callback -- Called with an error message or None, when the
+                             export succeeded, failed or was cancelled
+                             (defaults to None)
+
+        Callbacks must not return True, as they are run as idle callbacks.
+        """
+        self.pdfname = pdfname
+        self.pages = pages
+        self.filename = filename
+        self.progress_callback = progress_callback
+        self.finished_callback = finished_callback
+        self.cancelled = False
+        self.thread = None
+
+    def start(self):
+        """Run the export in a worker thread."""
+        self.thread = threading.Thread(target=self.run)
+        self.thread.start()
+
+    def cancel(self):
+        """Stop the export after the current page and remove the new file."""
+        self.cancelled = True
+
+    def run(self):
+        """
+        Run the export in the calling thread. If it fails or is cancelled, the
+        new file is removed.
+        """
+        surface = None
+        error = None
+        try:
+            surface = cairo.PDFSurface(self.filename, 0, 0)
+            uri = GLib.filename_to_uri(self.pdfname, None)
+            pdf = Poppler.Document.new_from_file(uri, None)
+            for pagenum, (width, height, layers) in enumerate(self.pages):
+                if self.cancelled:
+                    break
+                surface.set_size(width, height)
+                context = cairo.Context(surface)
+
+                pdf.get_page(pagenum).render_for_printing(context)
+
+                for strokes in layers:
+                    draw_strokes(context, strokes)
+
+                surface.show_page()  # aka "next page"
+                self._notify(self.progress_callback, pagenum + 1, len(self.pages))
+            surface.finish()
+        except Exception as ex:
+            print(_("Error saving document: {}").format(ex))
+            error = str(ex)
+
+        if surface is not None and (error is not None or self.cancelled):
+            try:
+                surface.finish()
+            except Exception:
+                pass
+            if os.path.exists(self.filename):
+                os.remove(self.filename)
+        self._notify(self.finished_callback, error)
+
+    def _notify(self, callback, *args):
+        """Run a callback (if any) in the thread, which started the export."""
+        if callback is None:
+            return
+        if self.thread is threading.current_thread():
+            GLib.idle_add(callback, *args)
+        else:
+            callback(*args)
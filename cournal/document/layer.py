@@ -17,10 +17,15 @@
 # You should have received a copy of the GNU General Public License
 # along with Cournal.  If not, see <http://www.gnu.org/licenses/>.
 
+from cournal.document.spatialindex import SpatialIndex
+
 
 class Layer:
     """
     A layer on a page, having a number and multiple strokes.
+
+    All finished strokes are kept in a SpatialIndex (self.index) to look them
+    up by their location.
     """
     def __init__(self, page, number, strokes=None):
         """
@@ -39,3 +44,6 @@ def __init__(self, page, number, strokes=None):
 
         if self.strokes is None:
             self.strokes = []
+        self.index = SpatialIndex()
+        for stroke in self.strokes:
+            self.index.insert(stroke)
@@ -49,6 +49,13 @@ def __init__(self, document, pdf, number, layers=None):
         self.widget = None
         self.width, self.height = pdf.get_size()
         self.search_marker = None
+        # Maps ids to strokes, that were acknowledged by the server
+        self.strokes_by_id = dict()
+        # Maps strokes we sent to the server to a token identifying the upload,
+        # as long as the server did not tell us their id
+        self.unconfirmed_strokes = dict()
+        # The stroke, which is being drawn, if any. Its coordinates still change.
+        self.unfinished_stroke = None
 
     def new_stroke(self, stroke, send_to_network=False):
         """
@@ -63,12 +70,47 @@ def new_stroke(self, stroke, send_to_network=False):
                            (defaults to False)
         """
         self.layers[0].strokes.append(stroke)
+        self.layers[0].index.insert(stroke)
         stroke.calculate_bounding_box()
         stroke.layer = self.layers[0]
         if self.widget:
             self.widget.draw_remote_stroke(stroke)
         if send_to_network:
-            network.new_stroke(self.number, stroke)
+            self._send_stroke(stroke)
+        elif stroke.id is not None:
+            self.strokes_by_id[stroke.id] = stroke
+
+    def new_strokes(self, strokes, send_to_network=False):
+        """
+        Add many new strokes to this page at once. The widget is updated only
+        once for all of them and they are sent to the server in a few large
+        messages.
+
+        Positional arguments:
+        strokes -- List of Stroke objects, that will be added to this page
+
+        Keyword arguments:
+        send_to_network -- Set True, to send the strokes to the server
+                           (defaults to False)
+        """
+        for stroke in strokes:
+            stroke.calculate_bounding_box()
+            stroke.layer = self.layers[0]
+            if not send_to_network:
+                self.strokes_by_id[stroke.id] = stroke
+            self.layers[0].index.insert(stroke)
+        self.layers[0].strokes.extend(strokes)
+        if self.widget:
+            self.widget.draw_remote_strokes(strokes)
+        if send_to_network and strokes:
+            d = network.new_strokes(self.number, strokes)
+            if d is not None:
+                tokens = []
+                for stroke in strokes:
+                    token = object()
+                    self.unconfirmed_strokes[stroke] = token
+                    tokens.append(token)
+                d.addCallback(self._stroke_ids_received, strokes, tokens)
 
     def new_unfinished_stroke(self, color, linewidth):
         """
@@ -79,7 +121,8 @@ def new_unfinished_stroke(self, color, linewidth):
         color -- tuple of four: (red, green, blue, opacity)
         linewidth -- Line width in pt
         """
-        return Stroke(layer=self.layers[0], color=color, linewidth=linewidth, coords=[])
+        self.unfinished_stroke = Stroke(layer=self.layers[0], color=color, linewidth=linewidth, coords=[])
+        return self.unfinished_stroke
 
     def finish_stroke(self, stroke):
         """
@@ -89,20 +132,83 @@ def finish_stroke(self, stroke):
         Positional arguments:
         stroke -- The Stroke object, that was finished
         """
+        if self.unfinished_stroke is stroke:
+            self.unfinished_stroke = None
+        if self.document.simplify_tolerance > 0:
+            stroke.simplify(self.document.simplify_tolerance)
         history.register_draw_stroke(stroke, self)
         stroke.calculate_bounding_box()
-        network.new_stroke(self.number, stroke)
+        self.layers[0].index.insert(stroke)
+        self._send_stroke(stroke)
 
-    def delete_stroke_with_coords(self, coords):
+    def _send_stroke(self, stroke):
+        """
+        Send a stroke to the server, if connected, and remember the id the
+        server assigns to it.
+
+        Positional arguments:
+        stroke -- The Stroke object, that was added to this page
+        """
+        if stroke.id is not None:
+            # The stroke was deleted and is added again (e.g. by undo)
+            self.strokes_by_id.pop(stroke.id, None)
+            stroke.id = None
+        d = network.new_stroke(self.number, stroke)
+        if d is not None:
+            token = object()
+            self.unconfirmed_strokes[stroke] = token
+            d.addCallback(self._stroke_id_received, stroke, token)
+
+    def _stroke_id_received(self, stroke_id, stroke, token):
+        """
+        Called, when the server assigned an id to a stroke we sent.
+
+        Positional arguments:
+        stroke_id -- The id of the stroke
+        stroke -- The Stroke object, that was sent
+        token -- Identifies the upload of the stroke
         """
-        Delete all strokes, which have exactly the same coordinates as given.
+        if stroke_id is None:
+            # The upload failed and we were disconnected
+            if self.unconfirmed_strokes.get(stroke) is token:
+                del self.unconfirmed_strokes[stroke]
+            return
+        if self.unconfirmed_strokes.get(stroke) is token:
+            del self.unconfirmed_strokes[stroke]
+            stroke.id = stroke_id
+            self.strokes_by_id[stroke_id] = stroke
+        else:
+            # The stroke was deleted locally, before we knew its id
+            network.delete_stroke(self.number, stroke_id)
+
+    def _stroke_ids_received(self, stroke_ids, strokes, tokens):
+        """
+        Called, when the server assigned ids to many strokes we sent at once.
+
+        Positional arguments:
+        stroke_ids -- List of the ids of the strokes
+        strokes -- List of the Stroke objects, that were sent
+        tokens -- List identifying the upload of each stroke
+        """
+        if stroke_ids is None:
+            # The upload failed and we were disconnected
+            for stroke, token in zip(strokes, tokens):
+                if self.unconfirmed_strokes.get(stroke) is token:
+                    del self.unconfirmed_strokes[stroke]
+            return
+        for stroke_id, stroke, token in zip(stroke_ids, strokes, tokens):
+            self._stroke_id_received(stroke_id, stroke, token)
+
+    def delete_stroke_with_id(self, stroke_id):
+        """
+        Delete the stroke with the given id, if it exists.
 
         Positional arguments
-        coords -- The list of coordinates
+        stroke_id -- The id assigned to the stroke by the server
         """
-        for stroke in self.layers[0].strokes[:]:
-            if stroke.coords == coords:
-                self.delete_stroke(stroke, send_to_network=False)
+        stroke = self.strokes_by_id.get(stroke_id)
+        if stroke is not None:
+            self.delete_stroke(stroke, send_to_network=False)
 
     def delete_stroke(self, stroke, send_to_network=False, register_in_history=True):
         """
@@ -118,13 +224,38 @@ def delete_stroke(self, stroke, send_to_network=False, register_in_history=True)
         register_in_history -- Make this command undoable
         """
         self.layers[0].strokes.remove(stroke)
+        self.layers[0].index.remove(stroke)
+        if stroke.id is not None:
+            self.strokes_by_id.pop(stroke.id, None)
         if self.widget:
             self.widget.delete_remote_stroke(stroke)
         if send_to_network:
-            network.delete_stroke_with_coords(self.number, stroke.coords)
+            if stroke.id is not None:
+                network.delete_stroke(self.number, stroke.id)
+            else:
+                # If the stroke is still being uploaded, _stroke_id_received()
+                # will delete it on the server.
+                self.unconfirmed_strokes.pop(stroke, None)
             if register_in_history:
                 history.register_delete_stroke(stroke, self)
 
+    def draw_search_marker(self, rect):
+        """
+        Mark a search result on this page.
+
+        Positional arguments:
+        rect -- The Poppler.Rectangle marking the found search text
+        """
+        self.search_marker = rect.x1, self.height - rect.y1, rect.x2, self.height - rect.y2
+        if self.widget:
+            self.widget.draw_search_marker()
+
+    def delete_search_marker(self):
+        """Remove the search result marker from this page."""
+        if self.widget:
+            self.widget.delete_search_marker()
+        self.search_marker = None
+
     def get_strokes_near(self, x, y, radius):
         """
         Finds strokes near a given point
@@ -134,13 +265,6 @@ def get_strokes_near(self, x, y, radius):
         y -- y coordinate of the given point
         radius -- Radius in pt, which influences the decision of what is considered "near"
 
-        Return value: Generator for a list of all strokes, which are near that point
+        Return value: List of all strokes, which are near that point
         """
-        for stroke in self.layers[0].strokes[:]:
-            if stroke.in_bounds(x, y):
-                for coord in stroke.coords:
-                    s_x = coord[0]
-                    s_y = coord[1]
-                    if ((s_x - x) ** 2 + (s_y - y) ** 2) < radius ** 2:
-                        yield stroke
-                        break
+        return list(self.layers[0].index.query_point(x, y, radius))
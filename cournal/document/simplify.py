@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# This file is part of Cournal.
+# Copyright (C) 2012 Fabian Henze
+#
+# Cournal is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cournal is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cournal.  If not, see <http://www.gnu.org/licenses/>.
+
+from array import array
+
+"""
+Simplification of strokes with the Ramer-Douglas-Peucker algorithm.
+"""
+
+
+def simplify_coords(coords, tolerance, widths=None):
+    """
+    Remove points from a stroke, which are not needed to keep the stroke within
+    a given distance of its original shape.
+
+    Positional arguments:
+    coords -- Flat array of coordinates (x0, y0, x1, y1, ...)
+    tolerance -- Maximum distance in pt between the old and the new stroke
+
+    Keyword arguments:
+    widths -- Array with one width per point or None. Widths of removed points
+              are removed as well. (defaults to None)
+
+    Return value: tuple of two: (array of coordinates, array of widths or None)
+    """
+    num_points = len(coords) // 2
+    if num_points < 3 or tolerance <= 0:
+        return coords, widths
+
+    max_distance = tolerance ** 2
+    keep = bytearray(num_points)
+    keep[0] = keep[-1] = 1
+    stack = [(0, num_points - 1)]
+
+    while stack:
+        first, last = stack.pop()
+        x1, y1 = coords[2 * first], coords[2 * first + 1]
+        dx = coords[2 * last] - x1
+        dy = coords[2 * last + 1] - y1
+        length = dx * dx + dy * dy
+
+        farthest = 0
+        farthest_distance = max_distance
+        for i in range(first + 1, last):
+            px = coords[2 * i] - x1
+            py = coords[2 * i + 1] - y1
+            # Squared distance between the point and the segment first--last
+            if length == 0:
+                t = 0
+            else:
+                t = min(1, max(0, (px * dx + py * dy) / length))
+            distance = (px - t * dx) ** 2 + (py - t * dy) ** 2
+            if distance > farthest_distance:
+                farthest = i
+                farthest_distance = distance
+
+        if farthest:
+            keep[farthest] = 1
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+
+    result = array("d")
+    for i in range(num_points):
+        if keep[i]:
+            result.append(coords[2 * i])
+            result.append(coords[2 * i + 1])
+    if widths is not None:
+        widths = array("d", (widths[i] for i in range(num_points) if keep[i]))
+    return result, widths
+
+
+def simplify_strokes(strokes, tolerance):
+    """
+    Simplify many strokes.
+
+    Positional arguments:
+    strokes -- Iterable of Stroke objects
+    tolerance -- Maximum distance in pt between the old and the new strokes
+
+    Return value: Number of points, that were removed
+    """
+    removed = 0
+    for stroke in strokes:
+        before = len(stroke.coords)
+        stroke.simplify(tolerance)
+        removed += (before - len(stroke.coords)) // 2
+    return removed
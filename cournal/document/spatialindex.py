@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# This file is part of Cournal.
+# Copyright (C) 2012 Fabian Henze
+#
+# Cournal is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cournal is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cournal.  If not, see <http://www.gnu.org/licenses/>.
+
+from array import array
+from math import floor
+
+CELL_SIZE = 32  # pt
+
+
+class SpatialIndex:
+    """
+    A uniform grid over the line segments of strokes, used to quickly find the
+    strokes near a given point.
+
+    Every cell of the grid knows which segments of which strokes overlap it
+    (including the line width), so a query only looks at the segments near the
+    queried point instead of all strokes on a page.
+    """
+    def __init__(self, cell_size=CELL_SIZE):
+        """
+        Constructor
+
+        Keyword arguments:
+        cell_size -- Width and height of a grid cell in pt (defaults to CELL_SIZE)
+        """
+        self.cell_size = cell_size
+        # Maps (column, row) to a dict, which maps strokes to an array of the
+        # positions of their segments in stroke.coords, for the segments
+        # overlapping that cell. Arrays need less memory than lists of ints.
+        self.cells = dict()
+        # Maps strokes to a list of the cells they overlap
+        self.stroke_cells = dict()
+
+    def insert(self, stroke):
+        """
+        Add a stroke to the index.
+
+        Positional arguments:
+        stroke -- The Stroke object
+        """
+        if stroke in self.stroke_cells:
+            self.remove(stroke)
+        cells = self.cells
+        size = self.cell_size
+        margin = stroke.linewidth / 2
+        coords = stroke.coords
+        keys = []
+        self.stroke_cells[stroke] = keys
+        if not coords:
+            return
+
+        last = len(coords) - 2
+        for i in range(0, max(2, len(coords) - 2), 2):
+            x1, y1 = coords[i], coords[i + 1]
+            x2, y2 = coords[min(i + 2, last)], coords[min(i + 2, last) + 1]
+            for column in range(floor((min(x1, x2) - margin) / size), floor((max(x1, x2) + margin) / size) + 1):
+                for row in range(floor((min(y1, y2) - margin) / size), floor((max(y1, y2) + margin) / size) + 1):
+                    key = (column, row)
+                    cell = cells.get(key)
+                    if cell is None:
+                        cell = cells[key] = dict()
+                    segments = cell.get(stroke)
+                    if segments is None:
+                        segments = cell[stroke] = array("I")
+                        keys.append(key)
+                    segments.append(i)
+
+    def remove(self, stroke):
+        """
+        Remove a stroke from the index, if it is indexed.
+
+        Positional arguments:
+        stroke -- The Stroke object
+        """
+        for key in self.stroke_cells.pop(stroke, ()):
+            cell = self.cells[key]
+            del cell[stroke]
+            if not cell:
+                del self.cells[key]
+
+    def _cell_range(self, x1, y1, x2, y2):
+        """Generator for all keys of existing cells overlapping a rectangle."""
+        size = self.cell_size
+        for column in range(floor(x1 / size), floor(x2 / size) + 1):
+            for row in range(floor(y1 / size), floor(y2 / size) + 1):
+                if (column, row) in self.cells:
+                    yield (column, row)
+
+    def query_point(self, x, y, radius):
+        """
+        Find strokes, which pass within a given distance of a point.
+
+        Positional arguments:
+        x -- x coordinate of the point
+        y -- y coordinate of the point
+        radius -- Maximum distance in pt between the point and the edge of a stroke
+
+        Return value: Set of Stroke objects
+        """
+        result = set()
+        for key in self._cell_range(x - radius, y - radius, x + radius, y + radius):
+            for stroke, segments in self.cells[key].items():
+                if stroke in result:
+                    continue
+                max_distance = radius + stroke.linewidth / 2
+                coords = stroke.coords
+                last = len(coords) - 2
+                for i in segments:
+                    j = min(i + 2, last)
+                    if _squared_distance_to_segment(x, y, coords[i], coords[i + 1], coords[j], coords[j + 1]) < max_distance ** 2:
+                        result.add(stroke)
+                        break
+        return result
+
+    def query_rect(self, x1, y1, x2, y2):
+        """
+        Find strokes, which may overlap a rectangle. The result can contain
+        strokes, which are close to the rectangle without touching it.
+
+        Positional arguments:
+        x1, y1 -- upper left corner of the rectangle
+        x2, y2 -- lower right corner of the rectangle
+
+        Return value: Set of Stroke objects
+        """
+        result = set()
+        for key in self._cell_range(x1, y1, x2, y2):
+            result.update(self.cells[key])
+        return result
+
+
+def _squared_distance_to_segment(x, y, x1, y1, x2, y2):
+    """
+    Return the squared distance between the point (x, y) and the line segment
+    from (x1, y1) to (x2, y2).
+    """
+    dx = x2 - x1
+    dy = y2 - y1
+    length = dx * dx + dy * dy
+    if length == 0:
+        t = 0
+    else:
+        t = min(1, max(0, ((x - x1) * dx + (y - y1) * dy) / length))
+    px = x1 + t * dx - x
+    py = y1 + t * dy - y
+    return px * px + py * py
@@ -17,19 +17,34 @@
 # You should have received a copy of the GNU General Public License
 # along with Cournal.  If not, see <http://www.gnu.org/licenses/>.
 
+from array import array
+from math import floor
+
 import cairo
 from twisted.spread import pb
 
+from cournal.document.simplify import simplify_coords
+
+# Scaling factors, for which a decimated version of each stroke is kept. When a
+# stroke is drawn smaller than 1 device pixel per pt, the points of the next
+# larger level are used.
+DETAIL_LEVELS = (0.5, 0.25, 0.125, 0.0625)
+# Size in device pixels of the cells, into which decimated strokes have at
+# most one point in a row
+DETAIL_TOLERANCE = 0.5
+
 
 class Stroke(pb.Copyable, pb.RemoteCopy):
     """
     A pen stroke on a layer, having a color, a linewidth and a list of coordinates
 
-    If a stroke has variable width, self.coords contains tuples of three,
-    else tuples of two floats.
+    The coordinates are stored in a flat array of floats (x0, y0, x1, y1, ...).
+    If a stroke has variable width, self.widths contains one width per point,
+    else it is None.
     FIXME: don't ignore the variable width
     """
-    def __init__(self, color, linewidth, layer=None, coords=None):
+
+    def __init__(self, color, linewidth, layer=None, coords=None, id=None, widths=None):
         """
         Constructor
 
@@ -39,14 +54,28 @@ def __init__(self, color, linewidth, layer=None, coords=None):
         linewidth -- Line width in pt
 
         Keyword arguments:
-        coords -- A list of coordinates (defaults to [])
+        coords -- A flat sequence of coordinates or a list of points, each
+                  being a list of x, y and optionally the width (defaults to [])
+        id -- Number identifying this stroke on its page. It is assigned by the
+              server (defaults to None)
+        widths -- A sequence of widths, one for each point. Ignored, if the
+                  widths are contained in coords. (defaults to None)
         """
+        self.id = id
         self.layer = layer
         self.color = color
         self.linewidth = linewidth
-        self.coords = coords
-        if self.coords is None:
-            self.coords = []
+        self.coords, self.widths = pack_coords(coords, widths)
+        self.invalidate_details()
+
+    def __setstate__(self, state):
+        """Restore a stroke pickled by cournal-server 0.2.1 or earlier."""
+        self.setCopyableState(state)
+
+    @property
+    def num_points(self):
+        """Number of points of this stroke"""
+        return len(self.coords) // 2
 
     def in_bounds(self, x, y):
         """
@@ -70,18 +99,100 @@ def calculate_bounding_box(self, radius=5):
         Keyword arguments:
         radius -- tolerance radius
         """
+        xs = self.coords[0::2]
+        ys = self.coords[1::2]
+        self.bound_min = [min(xs) - radius, min(ys) - radius]
+        self.bound_max = [max(xs) + radius, max(ys) + radius]
+
+    def simplify(self, tolerance):
+        """
+        Remove points, which are not needed to draw this stroke within a given
+        tolerance. The bounding box is not updated.
+
+        Positional arguments:
+        tolerance -- Maximum distance in pt between the old and the new stroke
+        """
+        self.coords, self.widths = simplify_coords(self.coords, tolerance, self.widths)
+        self.invalidate_details()
+
+    def invalidate_details(self):
+        """
+        Forget the decimated coordinates and paths computed by get_coords()
+        and get_path(). The caches are only created, when the stroke is drawn,
+        so strokes on the server don't need memory for them.
+        """
+        # Maps entries of DETAIL_LEVELS to decimated coordinates
+        self.details = None
+        # Maps entries of DETAIL_LEVELS (or None for the full stroke) to a
+        # cairo.Path of these coordinates
+        self.paths = None
 
-        bb_min_x = self.coords[0][0]
-        bb_max_x = self.coords[0][0]
-        bb_min_y = self.coords[0][1]
-        bb_max_y = self.coords[0][1]
-        for coord in self.coords[1:]:
-            bb_min_x = min(bb_min_x, coord[0])
-            bb_min_y = min(bb_min_y, coord[1])
-            bb_max_x = max(bb_max_x, coord[0])
-            bb_max_y = max(bb_max_y, coord[1])
-        self.bound_min = [bb_min_x - radius, bb_min_y - radius]
-        self.bound_max = [bb_max_x + radius, bb_max_y + radius]
+    def _prepare_details(self):
+        """
+        Create the caches of get_coords() and get_path(), or clear them, if
+        points were appended (while the stroke is drawn).
+        """
+        if self.details is None or self.details_length != len(self.coords):
+            self.details = dict()
+            self.paths = dict()
+            # Length of self.coords, when the details were computed
+            self.details_length = len(self.coords)
+
+    def get_coords(self, scaling=1):
+        """
+        Return the coordinates needed to draw this stroke at a given size.
+
+        For scalings up to DETAIL_LEVELS[0], the stroke is decimated by
+        decimate_coords(), so that it deviates by about DETAIL_TOLERANCE device
+        pixels from the full stroke. The decimated coordinates are computed on
+        first use and cached per entry of DETAIL_LEVELS.
+
+        Keyword arguments:
+        scaling -- Device pixels per pt (defaults to 1.0)
+
+        Return value: Flat array of coordinates (x0, y0, x1, y1, ...)
+        """
+        level = _detail_level(scaling)
+        if level is None or len(self.coords) <= 4:
+            return self.coords
+
+        self._prepare_details()
+        coords = self.details.get(level)
+        if coords is None:
+            coords = decimate_coords(self.coords, DETAIL_TOLERANCE / level)
+            self.details[level] = coords
+        return coords
+
+    def get_path(self, scaling=1, context=None):
+        """
+        Return a cairo.Path in pt of the coordinates returned by get_coords().
+        The path is built on first use and cached.
+
+        Keyword arguments:
+        scaling -- Device pixels per pt (defaults to 1.0)
+        context -- A cairo context with identity matrix and no current path,
+                   which is used to build the path (defaults to a new one)
+
+        Return value: A cairo.Path
+        """
+        self._prepare_details()
+        level = _detail_level(scaling) if len(self.coords) > 4 else None
+        path = self.paths.get(level)
+        if path is None:
+            if context is None:
+                context = _new_path_context()
+            coords = self.get_coords(scaling)
+            context.move_to(coords[0], coords[1])
+            if len(coords) > 2:
+                line_to = context.line_to
+                for x, y in zip(coords[2::2], coords[3::2]):
+                    line_to(x, y)
+            else:
+                context.line_to(coords[0], coords[1])
+            path = context.copy_path()
+            context.new_path()
+            self.paths[level] = path
+        return path
 
     def getStateToCopy(self):
         """Gather state to send when I am serialized for a peer."""
@@ -89,10 +200,41 @@ def getStateToCopy(self):
         # d would be self.__dict__.copy()
         d = dict()
         d["color"] = self.color
-        d["coords"] = self.coords
+        d["coords"] = self.coords.tolist()
         d["linewidth"] = self.linewidth
+        d["id"] = self.id
+        if self.widths is not None:
+            d["widths"] = self.widths.tolist()
         return d
 
+    def setCopyableState(self, state):
+        """
+        Initialize a stroke received from a peer.
+
+        Positional arguments:
+        state -- A dict, as returned by getStateToCopy() of the peer
+        """
+        self.id = state.get("id")
+        self.layer = None
+        self.color = state["color"]
+        self.linewidth = state["linewidth"]
+        self.coords, self.widths = pack_coords(state["coords"], state.get("widths"))
+        self.invalidate_details()
+
+    def get_state_to_save(self):
+        """
+        Returns the state, which is to be stored on disk.
+
+        The coordinates are saved as a list of points, each being a list of x,
+        y and (for strokes with variable width) the width.
+        """
+        coords = self.coords
+        if self.widths is None:
+            points = list(zip(coords[0::2], coords[1::2]))
+        else:
+            points = list(zip(coords[0::2], coords[1::2], self.widths))
+        return {"color": self.color, "coords": points, "linewidth": self.linewidth, "id": self.id}
+
     def draw(self, context, scaling=1):
         """
         Render this stroke
@@ -101,7 +243,8 @@ def draw(self, context, scaling=1):
         context -- The cairo context to draw on
 
         Keyword arguments:
-        scaling -- scale the stroke by this factor (defaults to 1.0)
+        scaling -- scale the stroke by this factor. Below 1, fewer points
+                   are drawn (defaults to 1.0)
         """
         context.save()
         r, g, b, opacity = self.color
@@ -112,13 +255,7 @@ def draw(self, context, scaling=1):
         context.set_line_cap(cairo.LINE_CAP_ROUND)
         context.set_line_width(self.linewidth)
 
-        first = self.coords[0]
-        context.move_to(first[0], first[1])
-        if len(self.coords) > 1:
-            for coord in self.coords[1:]:
-                context.line_to(coord[0], coord[1])
-        else:
-            context.line_to(first[0], first[1])
+        context.append_path(self.get_path(scaling))
         x, y, x2, y2 = (a * scaling for a in context.stroke_extents())
         context.stroke()
         context.restore()
@@ -126,5 +263,130 @@ def draw(self, context, scaling=1):
         return (x, y, x2, y2)
 
 
+def draw_strokes(context, strokes, scaling=1):
+    """
+    Render many strokes. This is faster than calling Stroke.draw() for each
+    of them.
+
+    Consecutive opaque strokes with the same color and linewidth are drawn
+    with a single stroke operation. Semitransparent strokes are drawn one by
+    one, because overlapping parts of strokes in one operation would not be
+    blended with each other.
+
+    Positional arguments:
+    context -- The cairo context to draw on
+    strokes -- Iterable of Stroke objects, in the order they are drawn in
+
+    Keyword arguments:
+    scaling -- scale the strokes by this factor. Below 1, fewer points
+               are drawn (defaults to 1.0)
+    """
+    context.save()
+    context.set_antialias(cairo.ANTIALIAS_GRAY)
+    context.set_line_join(cairo.LINE_JOIN_ROUND)
+    context.set_line_cap(cairo.LINE_CAP_ROUND)
+
+    path_context = _new_path_context()
+    batch = None
+    for stroke in strokes:
+        color = stroke.color
+        if batch != (color, stroke.linewidth):
+            if batch is not None:
+                context.stroke()
+            r, g, b, opacity = color
+            context.set_source_rgba(r / 255, g / 255, b / 255, opacity / 255)
+            context.set_line_width(stroke.linewidth)
+            batch = (color, stroke.linewidth)
+        context.append_path(stroke.get_path(scaling, path_context))
+        if color[3] != 255:
+            context.stroke()
+            batch = None
+    if batch is not None:
+        context.stroke()
+    context.restore()
+
+
+def decimate_coords(coords, cell_size):
+    """
+    Remove consecutive points, which fall into the same cell of a grid. This
+    takes linear time, unlike simplify_coords(), and is used for drawing
+    strokes smaller than their real size.
+
+    Positional arguments:
+    coords -- Flat array of coordinates (x0, y0, x1, y1, ...)
+    cell_size -- Width and height of a grid cell in pt
+
+    Return value: Flat array of the remaining coordinates. The first and the
+                  last point are always kept.
+    """
+    result = array("d", coords[0:2])
+    last_x = floor(coords[0] / cell_size)
+    last_y = floor(coords[1] / cell_size)
+    end = len(coords) - 2
+    for i in range(2, end, 2):
+        x = floor(coords[i] / cell_size)
+        y = floor(coords[i + 1] / cell_size)
+        if x != last_x or y != last_y:
+            result.append(coords[i])
+            result.append(coords[i + 1])
+            last_x = x
+            last_y = y
+    result.append(coords[end])
+    result.append(coords[end + 1])
+    return result
+
+
+def _detail_level(scaling):
+    """
+    Return the smallest entry of DETAIL_LEVELS, which is not smaller than
+    scaling, or None, if there is none.
+    """
+    level = None
+    for candidate in DETAIL_LEVELS:
+        if candidate < scaling:
+            break
+        level = candidate
+    return level
+
+
+def _new_path_context():
+    """Return a cairo context, which is only used to build paths."""
+    return cairo.Context(cairo.ImageSurface(cairo.FORMAT_A8, 1, 1))
+
+
+def pack_coords(coords, widths=None):
+    """
+    Convert coordinates to the compact representation used by Stroke.
+
+    Positional arguments:
+    coords -- A flat sequence of coordinates or a list of points, each being
+              a list of x, y and optionally the width. May be None.
+
+    Keyword arguments:
+    widths -- A sequence of widths, one for each point. Ignored, if the widths
+              are contained in coords. (defaults to None)
+
+    Return value: tuple of two: (array of coordinates, array of widths or None)
+    """
+    if not coords:
+        return array("d"), None
+    if isinstance(coords[0], (list, tuple)):
+        flat = array("d")
+        for point in coords:
+            flat.append(point[0])
+            flat.append(point[1])
+        if len(coords[0]) > 2:
+            widths = [point[2] for point in coords]
+        else:
+            widths = None
+    elif isinstance(coords, array):
+        flat = coords
+    else:
+        flat = array("d", coords)
+    if widths is not None:
+        widths = array("d", widths)
+    return flat, widths
+
+
 # Tell Twisted, that this class is allowed to be transmitted over the network.
 pb.setUnjellyableForClass(Stroke, Stroke)
@@ -18,7 +18,10 @@
 # along with xoj2tikz.  If not, see <http://www.gnu.org/licenses/>.
 
 import re
+import sys
+from array import array
 from gzip import open as open_xoj
+from itertools import chain
 
 import xml.etree.ElementTree as ET
 
@@ -28,7 +31,7 @@
 """A simplified parser for Xournal files using the ElementTree API."""
 
 
-def new_document(filename, window):
+def new_document(filename, window, tolerance=0):
     """
     Open a Xournal .xoj file
 
@@ -36,18 +39,32 @@ def new_document(filename, window):
     filename -- The filename of the Xournal document
     window -- A Gtk.Window, which can be used as the parent of MessageDialogs or the like
 
+    Keyword arguments:
+    tolerance -- Simplify new and imported strokes of the document within
+                 this tolerance in pt. 0 disables simplification. (defaults to 0)
+
     Return value: The new Document object
     """
-    with open_xoj(filename, "rb") as input:
-        tree = ET.parse(input)
-    pdfname = _get_background(tree)
-    document = Document(pdfname)
+    # The PDF is usually named in the background of the first page, so only
+    # the pages up to that one are kept in memory, before the document exists.
+    pages = iter_pages(filename, tolerance)
+    parsed_pages = []
+    pdfname = None
+    for page in pages:
+        parsed_pages.append(page)
+        if page[1] is not None:
+            pdfname = page[1]
+            break
+    if pdfname is None:
+        raise Exception("The xournal document has no PDF background")
+    document = Document(pdfname, tolerance)
 
     # We created an empty document with a PDF, now we will import the strokes:
-    return import_into_document(document, filename, window)
+    _add_pages(document, chain(parsed_pages, pages))
+    return document
 
 
-def import_into_document(document, filename, window):
+def import_into_document(document, filename, window, tolerance=None):
     """
     Parse a Xournal .xoj file and add all strokes to a given document.
 
@@ -59,23 +76,81 @@ def import_into_document(document, filename, window):
     filename -- The filename of the Xournal document
     window -- A Gtk.Window, which can be used as the parent of MessageDialogs or the like
 
+    Keyword arguments:
+    tolerance -- Simplify the imported strokes within this tolerance in pt. 0
+                 disables simplification. (defaults to the simplify_tolerance
+                 of the document)
+
     Return value: The modified Document object, that was given as an argument.
     """
-    with open_xoj(filename, "rb") as input:
-        tree = ET.parse(input)
+    if tolerance is None:
+        tolerance = document.simplify_tolerance
 
-    if tree.getroot().tag != "xournal":
-        raise Exception("Not a xournal document")
+    _add_pages(document, iter_pages(filename, tolerance))
+    return document
 
-    pages = tree.findall("page")
-    for p in range(len(pages)):
 
-        # we ignore layers for now. Cournal uses only layer 0
-        strokes = pages[p].findall("layer/stroke")
-        for s in range(len(strokes)):
-            stroke = _parse_stroke(strokes[s], document.pages[p].layers[0])
-            document.pages[p].new_stroke(stroke, send_to_network=True)
-    return document
+def iter_pages(filename, tolerance=0):
+    """
+    Generator, which parses a Xournal .xoj file page by page. Only one page
+    is kept in memory at once.
+
+    Positional Arguments:
+    filename -- The filename of the Xournal document
+
+    Keyword arguments:
+    tolerance -- Simplify the strokes within this tolerance in pt. 0 disables
+                 simplification. (defaults to 0)
+
+    Return value: Tuples of three: (page number, filename of the background
+                  PDF or None, list of Stroke objects)
+    """
+    with open_xoj(filename, "rb") as input:
+        events = ET.iterparse(input, events=("start", "end"))
+        event, root = next(events)
+        if root.tag != "xournal":
+            raise Exception("Not a xournal document")
+
+        pagenum = 0
+        pdfname = None
+        strokes = []
+        for event, element in events:
+            if event != "end":
+                continue
+            if element.tag == "stroke":
+                # we ignore layers for now. Cournal uses only layer 0
+                stroke = _parse_stroke(element, None)
+                if stroke is not None:
+                    if tolerance > 0:
+                        stroke.simplify(tolerance)
+                    strokes.append(stroke)
+            elif element.tag == "background":
+                pdfname = element.attrib.get("filename")
+            elif element.tag == "page":
+                yield pagenum, pdfname, strokes
+                pagenum += 1
+                pdfname = None
+                strokes = []
+                root.clear()
+
+
+def _add_pages(document, pages):
+    """
+    Add the strokes of parsed pages to a document. The strokes of each page
+    are added at once. Empty pages are skipped.
+
+    Positional Arguments:
+    document -- A Document object
+    pages -- Iterable of tuples as returned by iter_pages()
+    """
+    for pagenum, pdfname, strokes in pages:
+        if pagenum >= len(document.pages):
+            print(_("Warning: The xournal document has more pages than the PDF, ignoring them."),
+                  file=sys.stderr)
+            break
+        # Pages without strokes are not created, until they are shown
+        if strokes:
+            document.pages[pagenum].new_strokes(strokes, send_to_network=True)
 
 
 def _parse_stroke(stroke, layer):
@@ -84,7 +159,7 @@ def _parse_stroke(stroke, layer):
 
     Positional arguments:
     stroke -- A ElementTree SubElement representing a stroke from a .xoj document
-    layer -- A Layer object. NOT from ElementTree
+    layer -- A Layer object or None. NOT from ElementTree
 
     Return value: A Stroke instance
     """
@@ -95,8 +170,7 @@ def _parse_stroke(stroke, layer):
               file=sys.stderr)
         return
 
-    coordinates = []
-    temp = [float(x) for x in stroke.text.strip().split(' ') if len(x) > 0]
+    coordinates = array("d", map(float, stroke.text.split()))
     widths = [max(0.0, float(x)) for x in stroke.attrib["width"].split(' ')]
     nominal_width = widths.pop(0)
     if tool == "highlighter":
@@ -104,32 +178,18 @@ def _parse_stroke(stroke, layer):
     else:
         color = parse_color(stroke.attrib["color"])
 
-    for i in range(0, len(temp), 2):
-        x = temp[i]
-        y = temp[i + 1]
-        if len(widths) > 0:
-            width = widths[int(i / 2) - 1]
-            coordinates.append([x, y, width])
-        else:
-            coordinates.append([x, y])
+    if len(widths) > 0:
+        widths = [widths[i - 1] for i in range(len(coordinates) // 2)]
+    else:
+        widths = None
 
     # If the stroke is just a point, Xournal saves the same coordinates twice
-    if len(coordinates) == 2 and coordinates[0] == coordinates[1]:
-        del coordinates[1]
-
-    return Stroke(layer=layer, color=color, linewidth=nominal_width, coords=coordinates)
+    if len(coordinates) == 4 and coordinates[0:2] == coordinates[2:4]:
+        del coordinates[2:]
+        if widths is not None:
+            del widths[1:]
 
-
-def _get_background(tree):
-    """
-    Returns the background pdf file name of a Xournal document
-
-    Positional arguments:
-    tree -- An ElementTree representation of a .xoj XML tree
-    """
-    for bg in tree.findall("page/background"):
-        if "filename" in bg.attrib:
-            return bg.attrib["filename"]
+    return Stroke(layer=layer, color=color, linewidth=nominal_width, coords=coordinates, widths=widths)
 
 
 def parse_color(code, default_opacity=255):
@@ -184,5 +244,4 @@ def parse_color(code, default_opacity=255):
 
 # For testing purposes:
 if __name__ == "__main__":
-    import sys
     f = open_xoj(sys.argv[1], "rb")
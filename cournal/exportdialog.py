@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# This file is part of Cournal.
+# Copyright (C) 2012 Fabian Henze
+#
+# Cournal is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cournal is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cournal.  If not, see <http://www.gnu.org/licenses/>.
+
+from gi.repository import Gtk
+
+
+class ExportDialog(Gtk.Dialog):
+    """
+    A dialog showing the progress of a PDF export, which can be cancelled.
+    """
+    def __init__(self, parent=None, **args):
+        """
+        Constructor.
+
+        Keyword arguments:
+        parent -- Parent window of this dialog (defaults to no parent)
+        **args -- Arguments passed to the Gtk.Dialog constructor
+        """
+        super().__init__(**args)
+        self.export = None
+        # The export may report progress after the dialog was closed
+        self.closed = False
+
+        self.set_modal(False)
+        self.set_transient_for(parent)
+        self.set_title(_("Export PDF"))
+        self.set_default_size(300, -1)
+        self.add_button(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL)
+
+        self.progressbar = Gtk.ProgressBar()
+        self.progressbar.set_show_text(True)
+        self.progressbar.set_text(_("Exporting..."))
+        content_area = self.get_content_area()
+        content_area.set_border_width(6)
+        content_area.pack_start(self.progressbar, True, True, 6)
+
+        self.connect("response", self.response)
+        self.connect("destroy", self.destroyed)
+
+    def run_nonblocking(self, export):
+        """
+        Show the dialog asynchronously, reusing the mainloop of the parent.
+
+        Positional arguments:
+        export -- The PDFExport object, which is cancelled with the dialog
+        """
+        self.export = export
+        self.show_all()
+
+    def set_progress(self, done, total):
+        """
+        Show the number of pages, which were exported.
+
+        Positional arguments:
+        done -- Number of exported pages
+        total -- Number of all pages
+        """
+        if self.closed:
+            return
+        self.progressbar.set_fraction(done / total)
+        self.progressbar.set_text(_("Page {} of {}").format(done, total))
+
+    def finished(self, error):
+        """
+        Close the dialog, when the export is finished, and show the error, if
+        it failed.
+
+        Positional arguments:
+        error -- An error message or None, if the export did not fail
+        """
+        if error is not None:
+            message = Gtk.MessageDialog(self.get_transient_for(),
+                                        Gtk.DialogFlags.MODAL | Gtk.DialogFlags.DESTROY_WITH_PARENT,
+                                        Gtk.MessageType.ERROR,
+                                        Gtk.ButtonsType.OK,
+                                        _("Unable to export PDF"))
+            message.format_secondary_text(error)
+            message.set_title(_("Error"))
+            message.connect("response", lambda widget, response_id: message.destroy())
+            message.show()
+        if not self.closed:
+            self.destroy()
+
+    def response(self, widget, response_id):
+        """Cancel the export, when the dialog is closed by the user."""
+        if self.export:
+            self.export.cancel()
+        self.destroy()
+
+    def destroyed(self, widget):
+        """Called, when the dialog is destroyed."""
+        self.closed = True
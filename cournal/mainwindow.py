@@ -31,6 +31,7 @@
 from cournal.network import network
 from cournal.connectiondialog.connectiondialog import ConnectionDialog
 from cournal.aboutdialog import AboutDialog
+from cournal.exportdialog import ExportDialog
 from cournal.document import history
 from cournal.document import search
 
@@ -50,15 +51,18 @@ class MainWindow(Gtk.Window):
     """
     Cournals main window
     """
-    def __init__(self, **args):
+    def __init__(self, simplify_tolerance=0, **args):
         """
         Constructor.
 
         Keyword arguments:
+        simplify_tolerance -- If greater than 0, new and imported strokes are
+                              simplified within this tolerance in pt (defaults to 0)
         **args -- Arguments passed to the Gtk.Window constructor
         """
         super().__init__(title=_("Cournal"), **args)
         network.set_window(self)
+        self.simplify_tolerance = simplify_tolerance
 
         self.overlaybox = None
         self.document = None
@@ -219,18 +223,15 @@ def search_document(self, menuitem):
         # delete last results marker
         last_page = search.get_last_result_page()
         if last_page > -1:
-            for page in self.document.pages:
-                if page.number == int(last_page):
-                    page.widget.delete_search_marker()
+            self.document.pages[int(last_page)].delete_search_marker()
         result_page, result_pos = search.search(self.search_field.get_text())
         if result_page > -1:
             self.statusbar_pagenum_entry.set_text(str(result_page + 1))
-            for page in self.document.pages:
-                if page.number == int(result_page):
-                    page.widget.draw_search_marker(result_pos)
-                    self.vadjustment.set_value(page.widget.get_allocation().y
-                                               + page.widget.widget_height * (page.height - result_pos.y2) / page.height)
-                    self.hadjustment.set_value(page.widget.widget_width * result_pos.x1 / page.width)
+            page = self.document.pages[int(result_page)]
+            page.draw_search_marker(result_pos)
+            self.vadjustment.set_value(self.layout.get_page_offset(page.number)
+                                       + self.layout.get_page_height(page.number) * (page.height - result_pos.y2) / page.height)
+            self.hadjustment.set_value(self.layout.page_width * result_pos.x1 / page.width)
         else:
             self.search_field.modify_fg(0, Gdk.Color(65535, 0, 0))
 
@@ -250,9 +251,7 @@ def hide_search_bar(self, menuitem):
         # delete last results marker
         last_page = search.get_last_result_page()
         if last_page > -1:
-            for page in self.document.pages:
-                if page.number == int(last_page):
-                    page.widget.delete_search_marker()
+            self.document.pages[int(last_page)].delete_search_marker()
         search.reset()
 
     def reset_search(self, one, two, three, four):
@@ -264,9 +263,7 @@ def reset_search(self, one, two, three, four):
         self.search_field.modify_fg(0, Gdk.Color(0, 0, 0))
         last_page = search.get_last_result_page()
         if last_page > -1:
-            for page in self.document.pages:
-                if page.number == int(last_page):
-                    page.widget.delete_search_marker()
+            self.document.pages[int(last_page)].delete_search_marker()
         search.reset()
 
     def _set_document(self, document):
@@ -278,7 +275,7 @@ def _set_document(self, document):
         """
         self.document = document
         for child in self.scrolledwindow.get_children():
-            self.scrolledwindow.remove(child)
+            child.destroy()
         self.layout = Layout(self.document)
         self.scrolledwindow.add(self.layout)
         self.scrolledwindow.show_all()
@@ -304,32 +301,30 @@ def show_page_numbers(self, curr_vadjustment):
         """
         Show current and absolute page number in the center of the status bar.
 
-        To achieve that the current visible window and page size are compared
-        if there is a intersection. If so and more than 60% of the new page are
-        shown the current shown page number is updated.
+        To achieve that the visible pages are looked up in the page offsets of
+        the layout and their intersection with the visible window is computed.
+        If more than 60% of a page are shown the current shown page number is
+        updated.
 
         Positional Arguments:
         curr_vadjustment - current vertical adjustment of the scrollbar
         """
         biggest_intersection = [0, 0]
-
-        for page in self.document.pages:
-            rectangle = Gdk.Rectangle()
-            # horizontal adjustment is always 0, because the horizontal adjustment does not matter
-            rectangle.x = 0
-            rectangle.y = curr_vadjustment.get_value()
-            rectangle.height = self.layout.get_allocation().height
-            rectangle.width = self.layout.get_allocation().width
-            # calculation should work in most cases (visible pages <= 3)
-            intersect, intersection = page.widget.intersect(rectangle)
-            if intersect and (intersection.height > page.widget.get_allocated_height() * 0.6):
-                self.curr_page = page.number + 1
+        top = curr_vadjustment.get_value()
+        bottom = top + self.layout.get_allocation().height
+
+        for pagenum in self.layout.get_pages_in_range(top, bottom):
+            page_top = self.layout.get_page_offset(pagenum)
+            page_height = self.layout.get_page_height(pagenum)
+            intersection = min(bottom, page_top + page_height) - max(top, page_top)
+            if intersection > page_height * 0.6:
+                self.curr_page = pagenum + 1
                 self.statusbar_pagenum_entry.set_text(str(self.curr_page))
                 self.update_button_sensitivity()
                 return
-            if intersection.height > biggest_intersection[0]:
-                biggest_intersection[0] = intersection.height
-                biggest_intersection[1] = page.number + 1
+            if intersection > biggest_intersection[0]:
+                biggest_intersection[0] = intersection
+                biggest_intersection[1] = pagenum + 1
         # fallback if no page has a overall visibility of more than 60%.
         # In this case the page with the highest visibility is choosen
         self.curr_page = biggest_intersection[1]
@@ -383,8 +378,7 @@ def jump_to_page(self, page_num_widget):
             page_num = int(page_num_widget.get_text()) - 1
         except ValueError:
             return
-        page = self.document.pages[page_num]
-        self.vadjustment.set_value(page.widget.get_allocation().y)
+        self.vadjustment.set_value(self.layout.get_page_offset(page_num))
 
     def jump_to_next_page(self, menuitem):
         """
@@ -416,7 +410,7 @@ def run_open_pdf_dialog(self, menuitem):
             filename = dialog.get_filename()
 
             try:
-                document = Document(filename)
+                document = Document(filename, self.simplify_tolerance)
             except GError as ex:
                 self.run_error_dialog(_("Unable to open PDF"), ex)
                 dialog.destroy()
@@ -462,7 +456,7 @@ def run_open_xoj_dialog(self, menuitem):
             network.disconnect()
             filename = dialog.get_filename()
             try:
-                document = xojparser.new_document(filename, self)
+                document = xojparser.new_document(filename, self, self.simplify_tolerance)
             except Exception as ex:
                 import traceback
                 traceback.print_tb(ex.__traceback__)
@@ -481,7 +475,8 @@ def save(self, menuitem):
         menuitem -- The menu item, that triggered this function
         """
         if self.last_filename:
-            self.document.save_xoj_file(self.last_filename)
+            self.document.save_xoj_file(self.last_filename, in_background=True,
+                                        finished_callback=self.document_saved)
         else:
             self.run_save_as_dialog(menuitem)
 
@@ -497,10 +492,21 @@ def run_save_as_dialog(self, menuitem):
 
         if dialog.run() == Gtk.ResponseType.ACCEPT:
             filename = dialog.get_filename()
-            self.document.save_xoj_file(filename)
+            self.document.save_xoj_file(filename, in_background=True,
+                                        finished_callback=self.document_saved)
             self.last_filename = filename
         dialog.destroy()
 
+    def document_saved(self, error):
+        """
+        Called, when a .xoj file was written in the background.
+
+        Positional arguments:
+        error -- An error message or None, if the file was saved
+        """
+        if error is not None:
+            self.run_error_dialog(_("Unable to save document"), error)
+
     def run_export_pdf_dialog(self, menuitem):
         """
         Run an "Export" dialog and save the document to a PDF file.
@@ -513,7 +519,11 @@ def run_export_pdf_dialog(self, menuitem):
 
         if dialog.run() == Gtk.ResponseType.ACCEPT:
             filename = dialog.get_filename()
-            self.document.export_pdf(filename)
+            progress = ExportDialog(self)
+            export = self.document.export_pdf(filename, in_background=True,
+                                              progress_callback=progress.set_progress,
+                                              finished_callback=progress.finished)
+            progress.run_nonblocking(export)
         dialog.destroy()
 
     def run_about_dialog(self, menuitem):
@@ -535,7 +545,7 @@ def run_error_dialog(self, first, second):
         first -- Primary text of the message
         second -- Secondary text of the message
         """
-        print(_("Unable to open PDF file: {}").format(second))
+        print("{}: {}".format(first, second))
         message = Gtk.MessageDialog(self,
                                     Gtk.DialogFlags.MODAL | Gtk.DialogFlags.DESTROY_WITH_PARENT,
                                     Gtk.MessageType.ERROR,
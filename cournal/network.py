@@ -20,7 +20,7 @@
 from time import time
 
 from twisted.spread import pb
-from twisted.internet import reactor
+from twisted.internet import reactor, defer
 from twisted.cred import credentials
 
 # 0 - none
@@ -31,6 +31,8 @@
 
 PING_INTERVAL = 5
 PING_TIMEOUT = 5
+# Maximum number of coordinates sent in one message, when many strokes are sent
+UPLOAD_CHUNK_SIZE = 20000
 
 USERNAME = "test"
 PASSWORD = "testpw"
@@ -195,6 +197,19 @@ def remote_new_stroke(self, pagenum, stroke):
         if self.document and pagenum < len(self.document.pages):
             self.document.pages[pagenum].new_stroke(stroke)
 
+    def remote_new_strokes(self, pagenum, strokes):
+        """
+        Called by the server, to inform us about many new strokes on one page at
+        once (e.g. all preexisting strokes, when we join a document)
+
+        Positional arguments:
+        pagenum -- On which page shall we add the strokes
+        strokes -- List of received Stroke objects
+        """
+        self.data_received()
+        if self.document and pagenum < len(self.document.pages):
+            self.document.pages[pagenum].new_strokes(strokes)
+
     def new_stroke(self, pagenum, stroke):
         """
         Called by local code to send a new stroke to the server
@@ -202,34 +217,70 @@ def new_stroke(self, pagenum, stroke):
         Positional arguments:
         pagenum -- On which page the stroke was added
         stroke -- The Stroke object to send
+
+        Return value: A deferred, which fires with the id the server assigned
+                      to the stroke, or None if we are not connected
         """
         if self.is_connected:
             d = self.server_document.callRemote("new_stroke", pagenum, stroke)
-            d.addCallbacks(lambda x: self.data_received(), self.disconnect)
+            d.addCallbacks(self.data_received_with_result, self.disconnect)
+            return d
+
+    def new_strokes(self, pagenum, strokes):
+        """
+        Called by local code to send many new strokes on one page to the server.
+        They are sent in a few large messages.
+
+        Positional arguments:
+        pagenum -- On which page the strokes were added
+        strokes -- List of Stroke objects to send
+
+        Return value: A deferred, which fires with a list of the ids the server
+                      assigned to the strokes, or None if we are not connected
+        """
+        if not self.is_connected:
+            return
+        deferreds = []
+        chunk = []
+        num_coords = 0
+        for stroke in strokes:
+            chunk.append(stroke)
+            num_coords += len(stroke.coords)
+            if num_coords >= UPLOAD_CHUNK_SIZE:
+                deferreds.append(self.server_document.callRemote("new_strokes", pagenum, chunk))
+                chunk = []
+                num_coords = 0
+        if chunk:
+            deferreds.append(self.server_document.callRemote("new_strokes", pagenum, chunk))
+
+        d = defer.gatherResults(deferreds, consumeErrors=True)
+        d.addCallback(lambda chunks: [stroke_id for ids in chunks for stroke_id in ids])
+        d.addCallbacks(self.data_received_with_result, self.disconnect)
+        return d
 
-    def remote_delete_stroke_with_coords(self, pagenum, coords):
+    def remote_delete_stroke(self, pagenum, stroke_id):
         """
         Called by the server, when a remote user deleted a stroke
 
         Positional arguments:
         pagenum -- On which page the stroke was deleted
-        coords -- The list of coordinates identifying a stroke
+        stroke_id -- The id of the deleted stroke
         """
         self.data_received()
         if self.document and pagenum < len(self.document.pages):
-            self.document.pages[pagenum].delete_stroke_with_coords(coords)
+            self.document.pages[pagenum].delete_stroke_with_id(stroke_id)
 
-    def delete_stroke_with_coords(self, pagenum, coords):
+    def delete_stroke(self, pagenum, stroke_id):
         """
         Called by local code to send a delete command to the server
 
         Positional arguments:
         pagenum -- On which page the stroke was deleted
-        coords -- The list of coordinates identifying the stroke
+        stroke_id -- The id of the deleted stroke
         """
         if self.is_connected:
-            d = self.server_document.callRemote("delete_stroke_with_coords", pagenum, coords)
-            d.addCallback(lambda x, y: self.data_received(), self.disconnect)
+            d = self.server_document.callRemote("delete_stroke", pagenum, stroke_id)
+            d.addCallbacks(self.data_received_with_result, self.disconnect)
 
     def ping(self):
         """
@@ -246,6 +297,16 @@ def ping_successful(self, r):
         self.data_received()
         reactor.callLater(PING_INTERVAL, self.ping)
 
+    def data_received_with_result(self, result):
+        """
+        Like data_received(), but usable as a callback of a deferred.
+
+        Positional arguments:
+        result -- The result of the deferred, which is passed on unchanged
+        """
+        self.data_received()
+        return result
+
     def data_received(self):
         """
         Call this, when any kind of data is received from the server
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# This file is part of Cournal.
+# Copyright (C) 2012 Fabian Henze
+#
+# Cournal is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cournal is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cournal.  If not, see <http://www.gnu.org/licenses/>.
+
+import lzma
+import struct
+import sys
+import zlib
+from array import array
+
+from cournal.document.stroke import Stroke
+
+"""
+Compact binary encoding of saved server documents (file format version 2).
+
+After the version line, a file consists of:
+
+ * A header: compression method, sequence number of the last logged
+   operation and number of pages
+ * A table with the offset and length of every page in the file
+ * The pages, each compressed on its own. A page is the number of its
+   strokes, followed by the strokes. A stroke is its id, color, linewidth,
+   number of points and a flag for variable width, followed by the
+   coordinates (x0, y0, x1, y1, ...) and possibly the widths as float32.
+
+All numbers are little endian.
+"""
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZMA = 2
+
+_HEADER = struct.Struct("<BQI")
+_PAGE_ENTRY = struct.Struct("<QQ")
+_PAGE_HEADER = struct.Struct("<I")
+# id (0 for none), red, green, blue, opacity, linewidth, number of points,
+# has widths
+_STROKE_HEADER = struct.Struct("<I4BdIB")
+
+_compressors = {
+    COMPRESSION_NONE: lambda data: data,
+    COMPRESSION_ZLIB: lambda data: zlib.compress(data, 1),
+    COMPRESSION_LZMA: lzma.compress,
+}
+_decompressors = {
+    COMPRESSION_NONE: lambda data: data,
+    COMPRESSION_ZLIB: zlib.decompress,
+    COMPRESSION_LZMA: lzma.decompress,
+}
+
+
+def encode_document(document, file, compression=COMPRESSION_ZLIB):
+    """
+    Write a document in the binary format.
+
+    Positional arguments:
+    document -- The Document object of cournal-server
+    file -- A file object opened for writing bytes, positioned after the line
+            containing the file format version
+
+    Keyword arguments:
+    compression -- One of the COMPRESSION_* constants (defaults to COMPRESSION_ZLIB)
+    """
+    compress = _compressors[compression]
+    pages = [compress(_encode_page(page)) for page in document.pages]
+
+    start = file.tell()
+    offset = start + _HEADER.size + _PAGE_ENTRY.size * len(pages)
+    file.write(_HEADER.pack(compression, document.oplog_seq, len(pages)))
+    for data in pages:
+        file.write(_PAGE_ENTRY.pack(offset, len(data)))
+        offset += len(data)
+    for data in pages:
+        file.write(data)
+
+
+def _encode_page(page):
+    """Return the uncompressed binary representation of a page."""
+    parts = [_PAGE_HEADER.pack(len(page.strokes))]
+    for stroke in page.strokes.values():
+        red, green, blue, opacity = stroke.color
+        parts.append(_STROKE_HEADER.pack(stroke.id or 0, red, green, blue, opacity, stroke.linewidth,
+                                         len(stroke.coords) // 2, stroke.widths is not None))
+        parts.append(_pack_floats(stroke.coords))
+        if stroke.widths is not None:
+            parts.append(_pack_floats(stroke.widths))
+    return b"".join(parts)
+
+
+def decode_document(file):
+    """
+    Read a document written by encode_document().
+
+    Positional arguments:
+    file -- A file object opened for reading bytes, positioned after the line
+            containing the file format version
+
+    Return value: tuple of two: (list of pages, each being a list of Stroke
+                  objects, sequence number of the last logged operation)
+    """
+    compression, oplog_seq, num_pages = _HEADER.unpack(file.read(_HEADER.size))
+    table = file.read(_PAGE_ENTRY.size * num_pages)
+    pages = []
+    for offset, length in _PAGE_ENTRY.iter_unpack(table):
+        file.seek(offset)
+        pages.append(decode_page(file.read(length), compression))
+    return pages, oplog_seq
+
+
+def decode_page(data, compression):
+    """
+    Decode a single page.
+
+    Positional arguments:
+    data -- The bytes of the page, as found in the file
+    compression -- One of the COMPRESSION_* constants
+
+    Return value: List of Stroke objects
+    """
+    data = _decompressors[compression](data)
+    (num_strokes,) = _PAGE_HEADER.unpack_from(data)
+    position = _PAGE_HEADER.size
+    strokes = []
+    for i in range(num_strokes):
+        (stroke_id, red, green, blue, opacity, linewidth,
+         num_points, has_widths) = _STROKE_HEADER.unpack_from(data, position)
+        position += _STROKE_HEADER.size
+        coords = _unpack_floats(data, position, 2 * num_points)
+        position += 8 * num_points
+        widths = None
+        if has_widths:
+            widths = _unpack_floats(data, position, num_points)
+            position += 4 * num_points
+        strokes.append(Stroke([red, green, blue, opacity], linewidth, coords=coords,
+                              id=stroke_id or None, widths=widths))
+    return strokes
+
+
+def _pack_floats(values):
+    """Return an array of floats as little endian float32."""
+    floats = array("f", values)
+    if sys.byteorder == "big":
+        floats.byteswap()
+    return floats.tobytes()
+
+
+def _unpack_floats(data, position, count):
+    """Read count little endian float32 values into an array of doubles."""
+    floats = array("f")
+    floats.frombytes(data[position:position + 4 * count])
+    if sys.byteorder == "big":
+        floats.byteswap()
+    return array("d", floats)
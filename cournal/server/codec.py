@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# This file is part of Cournal.
+# Copyright (C) 2012 Fabian Henze
+#
+# Cournal is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cournal is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cournal.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+from array import array
+from itertools import chain
+
+from cournal.document.stroke import Stroke
+
+"""
+Fast encoding and decoding of documents in the JSON format of cournal-server.
+
+The files are compatible to those written with CournalEncoder, but the
+schema (Document -> Page -> Stroke) is hard coded: Strokes are written
+directly from their flat coordinate arrays, and decoded straight into them
+without reconstructing objects by their class name.
+"""
+
+_DOCUMENT_HEADER = '{"__class__":"Document","__module__":"cournal.server.server","pages":['
+_PAGE_HEADER = '{"__class__":"Page","__module__":"cournal.server.server","strokes":['
+_STROKE_HEADER = '{"__class__":"Stroke","__module__":"cournal.document.stroke","color":'
+
+
+def encode_document(document, file):
+    """
+    Write a document as JSON.
+
+    Positional arguments:
+    document -- The Document object of cournal-server
+    file -- A file object opened for writing text
+    """
+    write = file.write
+    write(_DOCUMENT_HEADER)
+    for pagenum, page in enumerate(document.pages):
+        if pagenum > 0:
+            write(",")
+        write(_PAGE_HEADER)
+        write(",".join(map(_encode_stroke, page.strokes.values())))
+        write("]}")
+    write('],"oplog_seq":{}}}'.format(document.oplog_seq))
+
+
+def _encode_stroke(stroke):
+    """Return the JSON representation of a Stroke object."""
+    coords = stroke.coords
+    if stroke.widths is None:
+        points = "],[".join(map("{!r},{!r}".format, coords[0::2], coords[1::2]))
+    else:
+        points = "],[".join(map("{!r},{!r},{!r}".format, coords[0::2], coords[1::2], stroke.widths))
+    # repr() of inf and nan is not valid JSON, let the json module handle them
+    if "n" in points:
+        points = json.dumps(stroke.get_state_to_save()["coords"])[2:-2]
+    return "".join((_STROKE_HEADER, json.dumps(stroke.color),
+                    ',"coords":[[', points, ']],"linewidth":', repr(stroke.linewidth),
+                    ',"id":', json.dumps(stroke.id), "}"))
+
+
+def decode_document(file):
+    """
+    Read a document written by encode_document() or CournalEncoder.
+
+    Positional arguments:
+    file -- A file object opened for reading text, positioned after the line
+            containing the file format version
+
+    Return value: tuple of two: (list of pages, each being a list of Stroke
+                  objects, sequence number of the last logged operation)
+    """
+    state = json.load(file, object_hook=_decode_stroke)
+    pages = [page["strokes"] for page in state["pages"]]
+    return pages, state.get("oplog_seq", 0)
+
+
+def _decode_stroke(d):
+    """
+    Turn a decoded JSON object into a Stroke, if it has coordinates. Strokes
+    are converted as soon as they are parsed, so the lists of points can be
+    freed right away.
+    """
+    points = d.get("coords")
+    if points is None:
+        return d
+    if points and len(points[0]) > 2:
+        coords = array("d", chain.from_iterable(point[:2] for point in points))
+        widths = array("d", [point[2] for point in points])
+    else:
+        coords = array("d", chain.from_iterable(points))
+        widths = None
+    return Stroke(d["color"], d["linewidth"], coords=coords, id=d.get("id"), widths=widths)
+
+
+def benchmark(num_pages=20, strokes_per_page=500, points_per_stroke=100):
+    """
+    Compare the throughput of this codec with CournalEncoder and
+    CournalDecoder on a generated document and print the results.
+
+    Keyword arguments:
+    num_pages -- Number of pages of the generated document (defaults to 20)
+    strokes_per_page -- Number of strokes per page (defaults to 500)
+    points_per_stroke -- Number of points per stroke (defaults to 100)
+    """
+    import io
+    import random
+    import time
+    from cournal.server.server import CournalEncoder, CournalDecoder, Document, Page
+
+    random.seed(0)
+    pages = []
+    for pagenum in range(num_pages):
+        strokes = []
+        for i in range(strokes_per_page):
+            coords = [random.uniform(0, 600) for j in range(2 * points_per_stroke)]
+            strokes.append(Stroke((0, 0, 128, 255), 1.5, coords=coords))
+        pages.append(Page(strokes))
+    document = Document("benchmark", pages)
+    num_coords = 2 * num_pages * strokes_per_page * points_per_stroke
+
+    def measure(name, function, repeat=3):
+        seconds = float("inf")
+        for i in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            seconds = min(seconds, time.perf_counter() - start)
+        print("{:28} {:7.3f} s {:10.0f} coordinates/s".format(name, seconds, num_coords / seconds))
+        return result
+
+    def encode_generic():
+        file = io.StringIO()
+        json.dump(document, file, cls=CournalEncoder)
+        return file.getvalue()
+
+    def encode_fast():
+        file = io.StringIO()
+        encode_document(document, file)
+        return file.getvalue()
+
+    generic = measure("CournalEncoder", encode_generic)
+    fast = measure("encode_document", encode_fast)
+    print("{:28} {:7.1f} MB / {:.1f} MB".format("Size", len(generic) / 2**20, len(fast) / 2**20))
+    measure("CournalDecoder", lambda: json.load(io.StringIO(generic), cls=CournalDecoder, documentname="benchmark"))
+    measure("decode_document", lambda: decode_document(io.StringIO(fast)))
+    measure("decode_document (old file)", lambda: decode_document(io.StringIO(generic)))
+
+
+# For testing purposes:
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# This file is part of Cournal.
+# Copyright (C) 2012 Fabian Henze
+#
+# Cournal is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cournal is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cournal.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import gettext
+import os
+import sys
+
+import cournal.server as server
+
+"""
+Convert saved documents of cournal-server between file format versions.
+
+Usage: python3 -m cournal.server.convert [-s AUTOSAVE_DIRECTORY] [-t VERSION]
+"""
+
+
+def run(directory, file_format_version=None):
+    """
+    Rewrite all saved documents in a directory in the given file format.
+
+    Positional arguments:
+    directory -- Path of the autosave directory of cournal-server
+
+    Keyword arguments:
+    file_format_version -- Version to convert the documents to (defaults to
+                           the version written by cournal-server)
+
+    Return value: Number of documents, that were converted
+    """
+    if file_format_version is None:
+        file_format_version = server.server.FILE_FORMAT_VERSION
+    converted = 0
+    for name, filename in server.server.find_documents(directory).items():
+        path = os.path.join(directory, filename)
+        with open(path, "rb") as file:
+            if int(file.readline()) == file_format_version:
+                continue
+        try:
+            document = server.server.load_document(path, name)
+        except server.server.NewerFileFormatError:
+            print(_("ERROR: Could not convert document '{}' because it was created with a newer version of cournal-server.").format(name), file=sys.stderr)
+            continue
+        before = os.path.getsize(path)
+        path = os.path.join(directory, server.server.docname_to_filename(name, file_format_version))
+        server.server.write_document(path, document, file_format_version)
+        print(_("Converted document '{}' ({} bytes -> {} bytes)").format(name, before, os.path.getsize(path)))
+        converted += 1
+    return converted
+
+
+def main():
+    """Convert the documents in the autosave directory given on the commandline."""
+    gettext.install("cournal")
+    parser = argparse.ArgumentParser(description=_("Convert saved documents of cournal-server to another file format version. "
+                                                   "Stop cournal-server before running this."))
+    parser.add_argument("-s", "--autosave-directory", default=server.server.DEFAULT_AUTOSAVE_DIRECTORY,
+                        help=_("The directory within which the documents are stored."))
+    parser.add_argument("-t", "--to", type=int, choices=[1, 2], default=server.server.FILE_FORMAT_VERSION,
+                        help=_("File format version to convert to: 1 (JSON) or 2 (binary)"))
+    args = parser.parse_args()
+
+    if os.path.exists(os.path.join(args.autosave_directory, "lock")):
+        print(_("The autosave directory is locked by cournal-server. Please stop it first."), file=sys.stderr)
+        return 1
+    converted = run(args.autosave_directory, args.to)
+    print(_("Converted {} documents").format(converted))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
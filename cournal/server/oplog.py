@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# This file is part of Cournal.
+# Copyright (C) 2012 Fabian Henze
+#
+# Cournal is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cournal is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cournal.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+
+class OperationLog:
+    """
+    An append-only file of operations on a single document, one record per line.
+
+    The log complements the (periodically written) snapshot of a document: every
+    modification is appended here as soon as it arrives, so nothing is lost when
+    the server crashes between two snapshots. After a snapshot was written, the
+    log is truncated.
+
+    While a snapshot is written in the background, new records must not be lost
+    with the log, so the log is rotated, when the snapshot is taken: The old
+    records are moved to "filename.old", which is removed after the snapshot was
+    written.
+    """
+    def __init__(self, filename):
+        """
+        Constructor
+
+        Positional arguments:
+        filename -- Path of the log file. It is created on the first append.
+        """
+        self.filename = filename
+        self.rotated_filename = filename + ".old"
+        self.file = None
+
+    def append(self, record):
+        """
+        Append a record to the log and flush it to the operating system.
+
+        Positional arguments:
+        record -- A string, which must not contain a newline character
+        """
+        if self.file is None:
+            self._remove_incomplete_record(self.filename)
+            self.file = open(self.filename, "a")
+        self.file.write(record + "\n")
+        self.file.flush()
+
+    def records(self):
+        """
+        Generator for all records, that were written to the log.
+
+        Records of a rotated log come first. A last line without a trailing
+        newline was only partially written when the server crashed and is ignored.
+        """
+        for filename in (self.rotated_filename, self.filename):
+            if not os.path.exists(filename):
+                continue
+            with open(filename, "r") as file:
+                for line in file:
+                    if line.endswith("\n"):
+                        yield line[:-1]
+
+    def rotate(self):
+        """
+        Move all records to the rotated log and start a new, empty log. If the
+        rotated log still exists, because the last snapshot failed, the
+        records are appended to it.
+        """
+        self.close()
+        if not os.path.exists(self.filename):
+            return
+        if not os.path.exists(self.rotated_filename):
+            os.rename(self.filename, self.rotated_filename)
+            return
+        self._remove_incomplete_record(self.rotated_filename)
+        with open(self.rotated_filename, "a") as rotated, open(self.filename, "r") as file:
+            for line in file:
+                if line.endswith("\n"):
+                    rotated.write(line)
+            rotated.flush()
+        os.remove(self.filename)
+
+    def remove_rotated(self):
+        """Remove the records of the rotated log."""
+        if os.path.exists(self.rotated_filename):
+            os.remove(self.rotated_filename)
+
+    def truncate(self):
+        """Remove all records from the log, including the rotated ones."""
+        self.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+        self.remove_rotated()
+
+    @staticmethod
+    def _remove_incomplete_record(filename):
+        """
+        Cut off a partially written last line of a file, so that records
+        appended to it start on a new line.
+        """
+        if not os.path.exists(filename):
+            return
+        with open(filename, "rb+") as file:
+            size = file.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            file.seek(size - 1)
+            if file.read(1) == b"\n":
+                return
+            # Search backwards for the end of the last complete record
+            position = size
+            while position > 0:
+                start = max(0, position - 4096)
+                file.seek(start)
+                chunk = file.read(position - start)
+                newline = chunk.rfind(b"\n")
+                if newline != -1:
+                    file.truncate(start + newline + 1)
+                    return
+                position = start
+            file.truncate(0)
+
+    def close(self):
+        """Close the underlying file. It will be reopened on the next append."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -18,10 +18,8 @@
 # You should have received a copy of the GNU General Public License
 # along with Cournal.  If not, see <http://www.gnu.org/licenses/>.
 
-import json
 import os
 import pickle
-from tempfile import NamedTemporaryFile
 
 import cournal.server as server
 
@@ -32,19 +30,19 @@ def run(from_dir, to_dir=None):
 
     Arguments:
     from_dir -- Path of the directory where the old .save files are
-    to_dir -- Path of the directory where the new .json files shall be saved to
+    to_dir -- Path of the directory where the new files shall be saved to
              (defaults to `from_dir`)
     """
     if to_dir is None:
         to_dir = from_dir
 
     for filename in [s for s in os.listdir(from_dir) if s.startswith("cnl-") and s.endswith(".save")]:
-        if os.path.exists(os.path.join(to_dir, filename[:-5] + ".json")):
-            continue
         name = server.server.filename_to_docname(filename)
+        if server.server.find_documents(to_dir, name):
+            continue
         with open(os.path.join(from_dir, filename), "rb") as file:
-            document = server.server.Document(name)
-            document.pages = pickle.load(file)
+            pages = [server.server.Page(page.strokes) for page in pickle.load(file)]
+            document = server.server.Document(name, pages)
         _save(document, to_dir)
         print(_("NOTE: Found document '{}' saved by cournal-server 0.2.1 or earlier.\n"
                 "      It will be converted to a new file format. Please make sure the\n"
@@ -53,18 +51,11 @@ def run(from_dir, to_dir=None):
 
 def _save(document, dir):
     """
-    Saves the given Document() in the given directory as a .json file
+    Saves the given Document() in the given directory
 
     Arguments:
     document -- The Document instance which shall be saved
     dir -- The path where the file shall be saved to
     """
-    # We write to a tmpfile and move it to the actual location to ensure
-    # atomic writing of the file, meaning: In case of a crash, either the
-    # old or the new version of that file is on the disk
     filename = server.server.docname_to_filename(document.name)
-    tmpfile = NamedTemporaryFile(prefix=filename[:-5] + '-', suffix='.delete-me', dir=dir, mode='w', delete=False)
-    tmpfile.write(str(server.server.FILE_FORMAT_VERSION) + '\n')
-    json.dump(document, tmpfile, cls=server.server.CournalEncoder)
-    tmpfile.close()
-    os.rename(tmpfile.name, os.path.join(dir, filename))
+    server.server.write_document(os.path.join(dir, filename), document)
@@ -23,21 +23,28 @@
 import json
 import os
 import string
+import sqlite3
 import subprocess
 import sys
-from io import StringIO
+import time
+from io import StringIO, TextIOWrapper
 from tempfile import NamedTemporaryFile
 
 from zope.interface import implementer
 from twisted.cred import portal, checkers
 from twisted.spread import pb
-from twisted.internet import reactor
+from twisted.internet import reactor, defer, threads
 from twisted.internet.error import CannotListenError
 from twisted.python.failure import Failure
 
 from cournal import __versionstring__ as cournal_version
 from cournal.document.stroke import Stroke
+from cournal.document.simplify import simplify_strokes
+from cournal.server import binaryformat
+from cournal.server import codec
 from cournal.server import pickle_legacy
+from cournal.server.oplog import OperationLog
+from cournal.server.sqlitestorage import SQLiteStorage
 
 # 0 - none
 # 1 - minimum
@@ -48,14 +55,29 @@
 DEFAULT_AUTOSAVE_DIRECTORY = os.path.expanduser("~/.cournal/documents")
 DEFAULT_AUTOSAVE_INTERVAL = 60
 DEFAULT_PORT = 6524
+# Seconds, after which a document without users is removed from memory
+DEFAULT_IDLE_TIMEOUT = 600
+# Name of the database in the autosave directory, if documents are stored with SQLite
+DATABASE_FILENAME = "cournal.sqlite"
 USERNAME = "test"
 PASSWORD = "testpw"
-FILE_FORMAT_VERSION = 1
+# Version 1 is JSON, version 2 the binary format of cournal.server.binaryformat
+FILE_FORMAT_VERSION = 2
+# Maps file format versions to the extension of the saved documents
+FILE_EXTENSIONS = {1: ".json", 2: ".cnl"}
+# Maximum number of coordinates sent in one message, when a user joins a document
+SYNC_CHUNK_SIZE = 20000
+# Rough estimate of the memory used by a Stroke object without its coordinates
+STROKE_OVERHEAD = 300
 
 # List of all characters that are allowed in filenames. Must not contain ; and :
 valid_characters = string.ascii_letters + string.digits + ' _()+,.-=^~'
 
 
+class NewerFileFormatError(Exception):
+    """Raised, when a document was saved by a newer version of cournal-server."""
+
+
 class CournalEncoder(json.JSONEncoder):
     """
     Encodes a any given object and all its properties to JSON.
@@ -75,6 +97,16 @@ def default(self, obj):
         return d
 
 
+class CournalLogEncoder(CournalEncoder):
+    """
+    Like CournalEncoder, but puts everything on a single line, as needed for
+    records in an OperationLog.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.indent = None
+
+
 class CournalDecoder(json.JSONDecoder):
     """
     Reconstructs objects and their properties from JSON files generated by
@@ -111,31 +143,102 @@ class Page:
     A page in a document, having multiple strokes.
     """
     def __init__(self, strokes=None):
-        if strokes is None:
-            self.strokes = []
-        else:
-            self.strokes = strokes
+        """
+        Arguments:
+        strokes -- List of Stroke objects (default  [])
+        """
+        # Maps stroke ids to strokes. Dicts preserve the insertion order, which
+        # is the order the strokes are drawn in.
+        self.strokes = dict()
+        self.next_stroke_id = 1
+        if strokes is not None:
+            for stroke in strokes:
+                self.add_stroke(stroke)
+
+    def get_state_to_save(self):
+        """Returns a subset of self.__dict__, which is to be stored on disk."""
+        return {"strokes": list(self.strokes.values())}
+
+    def copy(self):
+        """Return a copy of this page, that shares the Stroke objects."""
+        page = Page()
+        page.strokes = dict(self.strokes)
+        page.next_stroke_id = self.next_stroke_id
+        return page
+
+    def add_stroke(self, stroke):
+        """
+        Add a stroke to this page. If it has no id yet, a new one is assigned.
+
+        Positional arguments:
+        stroke -- The new stroke
+
+        Return value: The id of the stroke
+        """
+        # Documents saved by older versions of cournal-server have no stroke ids
+        if getattr(stroke, "id", None) is None:
+            stroke.id = self.next_stroke_id
+        self.next_stroke_id = max(self.next_stroke_id, stroke.id + 1)
+        self.strokes[stroke.id] = stroke
+        return stroke.id
+
+    def delete_stroke(self, stroke_id):
+        """
+        Delete a stroke from this page.
+
+        Positional arguments:
+        stroke_id -- The id of the stroke
+
+        Return value: True, if the stroke existed
+        """
+        return self.strokes.pop(stroke_id, None) is not None
 
 
 class CournalServer:
     """
     The server object, that holds global state, which is shared between all users.
     """
-    def __init__(self, autosave_directory, autosave_interval, save_hook):
+    def __init__(self, autosave_directory, autosave_interval, save_hook, simplify_tolerance=0,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, max_memory=0, storage="files"):
         """
         Constructor.
 
-        Test, if the autosave directory is writable and load saved data.
+        Test, if the autosave directory is writable and find the saved documents.
+        They are loaded, when they are requested for the first time.
 
         Positional arguments:
         autosave_directory -- The directory within which to store the documents
         autosave_interval -- Interval in seconds within which to save the documents
         save_hook -- Script or application to execute after the documents were saved
+
+        Keyword arguments:
+        simplify_tolerance -- If greater than 0, simplify all strokes of the loaded
+                              documents within this tolerance in pt (defaults to 0)
+        idle_timeout -- Remove documents without users from memory after this
+                        many seconds. 0 disables it. (defaults to DEFAULT_IDLE_TIMEOUT)
+        max_memory -- Remove the least recently used documents without users
+                      from memory, while all documents need more than this many
+                      bytes. 0 means no limit. (defaults to 0)
+        storage -- "files" to save every document in its own file or "sqlite"
+                   to store all documents in the SQLite database DATABASE_FILENAME
+                   (defaults to "files")
         """
+        # Maps names to the documents, which are in memory
         self.documents = dict()
+        # Maps names of all saved documents to a tuple of two: (file size, mtime)
+        self.catalog = dict()
+        # Maps names of documents, which are being loaded, to a list of Deferreds
+        # waiting for them
+        self.loading = dict()
         self.autosave_directory = os.path.abspath(autosave_directory)
         self.autosave_interval = autosave_interval
         self.save_hook = save_hook
+        self.simplify_tolerance = simplify_tolerance
+        self.idle_timeout = idle_timeout
+        self.max_memory = max_memory
+        self.lockfile = None
+        # The SQLiteStorage, if documents are stored in a database
+        self.database = None
 
         # Don't create the autosave directory, if autosaving is disabled
         if self.autosave_interval == 0:
@@ -152,27 +255,30 @@ def __init__(self, autosave_directory, autosave_interval, save_hook):
                 except Exception as ex:
                     print(_("Could not create autosave directory: {}").format(self.autosave_directory, ex), file=sys.stderr)
                     raise ex
-        self.obtain_lockfile()
 
-        # Convert saved documents pickled by cournal-server 0.2.1 or earlier
-        if DEFAULT_AUTOSAVE_DIRECTORY == self.autosave_directory:
-            pickle_legacy.run(from_dir=os.path.expanduser("~/.cournal"), to_dir=self.autosave_directory)
+        if storage == "sqlite":
+            filename = os.path.join(self.autosave_directory, DATABASE_FILENAME)
+            try:
+                self.database = SQLiteStorage(filename)
+            except sqlite3.OperationalError as ex:
+                print(_("Could not open database '{}': {}").format(filename, ex), file=sys.stderr)
+                sys.exit(-1)
+            self.import_saved_files()
+            self.catalog = self.database.catalog()
         else:
-            pickle_legacy.run(self.autosave_directory)
-
-        # Load saved documents
-        for filename in [s for s in os.listdir(self.autosave_directory) if s.startswith("cnl-") and s.endswith(".json")]:
-            name = filename_to_docname(filename)
-            with open(os.path.join(self.autosave_directory, filename), "r") as file:
-                file_format_version = int(file.readline())
-                if file_format_version > FILE_FORMAT_VERSION:
-                    print(_("ERROR: Could not load document '{}' because it was created with a newer version of cournal-server.").format(name), file=sys.stderr)
-                    continue
-                document = json.load(file, cls=CournalDecoder, documentname=name)
-                if document:
-                    self.documents[name] = document
-
-        debug(1, _("Loaded {} documents").format(len(self.documents)))
+            self.obtain_lockfile()
+
+            # Convert saved documents pickled by cournal-server 0.2.1 or earlier
+            if DEFAULT_AUTOSAVE_DIRECTORY == self.autosave_directory:
+                pickle_legacy.run(from_dir=os.path.expanduser("~/.cournal"), to_dir=self.autosave_directory)
+            else:
+                pickle_legacy.run(self.autosave_directory)
+
+            for name in find_documents(self.autosave_directory):
+                self.update_catalog(name)
+
+        size = sum(size for size, mtime in self.catalog.values())
+        debug(1, _("Found {} documents ({:.1f} MB)").format(len(self.catalog), size / 2**20))
 
         reactor.callLater(self.autosave_interval, self.save_documents)
 
@@ -233,60 +339,311 @@ def exit(self):
         The program is about to terminate. Save documents and release lockfile
         """
         if self.autosave_interval > 0:
-            # Save on exit, if the user enabled autosave
-            self.save_documents()
+            if self.database:
+                # All modifications are in the database, once the queued ones
+                # are committed
+                self.database.close()
+                return
+            # Save on exit, if the user enabled autosave. The reactor is not
+            # running anymore, so the documents are saved in this thread.
+            for name, document in self.documents.items():
+                if document.has_unsaved_changes:
+                    self.save_document(name, document)
             # and release the directory lock
             self.release_lockfile()
+            for document in self.documents.values():
+                if document.oplog:
+                    document.oplog.close()
+
+    def import_saved_files(self):
+        """
+        Copy the documents saved in files in the autosave directory, which are
+        not in the database yet, into the database.
+        """
+        for name, filename in find_documents(self.autosave_directory).items():
+            if name in self.database.document_ids:
+                continue
+            try:
+                document = load_document(os.path.join(self.autosave_directory, filename), name)
+            except NewerFileFormatError:
+                print(_("ERROR: Could not load document '{}' because it was created with a newer version of cournal-server.").format(name), file=sys.stderr)
+                continue
+            self.open_operation_log(name, document)
+            document.replay_operation_log()
+            document.oplog.close()
+            self.database.write_document(document)
+            print(_("NOTE: Document '{}' was copied into the database. Please make sure the\n"
+                    "      conversion went fine and delete the old files: '{}' and '{}'.").format(
+                    name, filename, docname_to_logname(name)))
+
+    def open_operation_log(self, name, document):
+        """
+        Attach an OperationLog named "autosave_directory/cnl-documentname.log"
+        to a document, so that all further modifications are logged.
+
+        Positional arguments:
+        name -- Name of the document
+        document -- The Document object
+        """
+        logfile = os.path.join(self.autosave_directory, docname_to_logname(name))
+        document.oplog = OperationLog(logfile)
+
+    def update_catalog(self, name):
+        """
+        Remember the size and modification time of the saved file of a document.
+
+        Positional arguments:
+        name -- Name of the document
+        """
+        filename = find_documents(self.autosave_directory, name)[name]
+        stat = os.stat(os.path.join(self.autosave_directory, filename))
+        self.catalog[name] = (stat.st_size, stat.st_mtime)
 
     def save_documents(self):
         """
-        Save all documents to files named "autosave_directory/cnl-documentname.json".
+        Save all modified documents to files named
+        "autosave_directory/cnl-documentname.cnl" in worker threads.
+        The next autosave is scheduled, when all of them were written.
+
+        If documents are stored in a database, only the queued operations are
+        committed.
+
+        Return value: A Deferred, which fires when all documents were saved
         """
         debug(3, _("Saving all documents."))
-        savedfiles = []
+        if self.database:
+            savedfiles = []
+            try:
+                self.database.flush()
+                # Operations are committed as they arrive, so documents, which
+                # were modified since the last autosave, are already written.
+                if any(document.has_unsaved_changes for document in self.documents.values()):
+                    savedfiles.append(DATABASE_FILENAME)
+            except sqlite3.Error as ex:
+                print(_("Error writing to database '{}': {}").format(self.database.filename, ex), file=sys.stderr)
+            else:
+                for document in self.documents.values():
+                    document.has_unsaved_changes = False
+            d = defer.succeed(savedfiles)
+            d.addCallback(self.documents_saved)
+            return d
+
+        deferreds = []
         for name, document in self.documents.items():
-            if not document.has_unsaved_changes:
-                continue
-            debug(2, _("Saving document '{}' to '{}'").format(name, os.path.join(self.autosave_directory, docname_to_filename(name))))
-            # We write to a tmpfile and move it to the actual location to ensure
-            # atomic writing of the file, meaning: In case of a crash, either the
-            # old or the new version of that file is on the disk
-            filename = docname_to_filename(name)
-            tmpfile = NamedTemporaryFile(prefix=filename[:-5] + '-', suffix='.delete-me', dir=self.autosave_directory, mode='w', delete=False)
-            tmpfile.write(str(FILE_FORMAT_VERSION) + '\n')
-            json.dump(document, tmpfile, cls=CournalEncoder)
-            tmpfile.close()
-            os.rename(tmpfile.name, os.path.join(self.autosave_directory, filename))
-            document.has_unsaved_changes = False
-            savedfiles.append(filename)
+            if document.has_unsaved_changes:
+                deferreds.append(self.save_document_in_background(name, document))
 
+        d = defer.gatherResults(deferreds)
+        d.addCallback(self.documents_saved)
+        return d
+
+    def documents_saved(self, savedfiles):
+        """
+        Called, when an autosave is finished. Run the save hook and schedule
+        the next autosave.
+
+        Positional arguments:
+        savedfiles -- List of the filenames of all saved documents, or None for
+                      documents, which could not be saved
+        """
+        savedfiles = [filename for filename in savedfiles if filename is not None]
         if self.save_hook is not None and savedfiles:
             subprocess.Popen([self.save_hook, self.autosave_directory] + savedfiles)
 
+        self.evict_documents()
         reactor.callLater(self.autosave_interval, self.save_documents)
 
+    def save_document(self, name, document):
+        """
+        Write a snapshot of a document to "autosave_directory/cnl-documentname.cnl"
+        and compact its operation log, as the snapshot contains all logged operations.
+
+        Positional arguments:
+        name -- Name of the document
+        document -- The Document object
+        """
+        filename = docname_to_filename(name)
+        debug(2, _("Saving document '{}' to '{}'").format(name, os.path.join(self.autosave_directory, filename)))
+        write_document(os.path.join(self.autosave_directory, filename), document)
+        document.has_unsaved_changes = False
+        self.update_catalog(name)
+        # If we crash right here, the log is replayed on top of the new snapshot.
+        # That's fine, as replay_operation_log() skips everything it contains.
+        if document.oplog:
+            document.oplog.truncate()
+
+    def save_document_in_background(self, name, document):
+        """
+        Like save_document(), but only take a snapshot of the document in the
+        reactor thread. It is encoded and written in a worker thread, so users
+        are served in the meantime.
+
+        Positional arguments:
+        name -- Name of the document
+        document -- The Document object
+
+        Return value: A Deferred, which fires with the filename of the saved
+                      document or None, if saving failed
+        """
+        filename = docname_to_filename(name)
+        debug(2, _("Saving document '{}' to '{}'").format(name, os.path.join(self.autosave_directory, filename)))
+        snapshot = document.snapshot()
+        document.has_unsaved_changes = False
+        # Operations arriving from now on are not contained in the snapshot
+        if document.oplog:
+            document.oplog.rotate()
+
+        def saved(result):
+            if document.oplog:
+                document.oplog.remove_rotated()
+            self.update_catalog(name)
+            return filename
+
+        def failed(failure):
+            print(_("Error saving document '{}': {}").format(name, failure.getErrorMessage()), file=sys.stderr)
+            document.has_unsaved_changes = True
+            return None
+
+        d = threads.deferToThread(write_document, os.path.join(self.autosave_directory, filename), snapshot)
+        d.addCallbacks(saved, failed)
+        return d
+
     def get_document(self, documentname):
         """
         Returns a Document object given its name. If none with this name exists,
-        it will be created.
+        it will be created. Saved documents are loaded on first use.
 
         Positional arguments:
         documentname -- Name of the document you want to get
+
+        Return value: The Document object, a Deferred firing with it, if it
+                      must be loaded first, or a Failure
         """
-        if documentname not in self.documents:
-            if self.autosave_interval > 0:
-                # Try to create a savefile, if it fails deny the document creation
-                filename = docname_to_filename(documentname)
-                try:
-                    file = open(os.path.join(self.autosave_directory, filename), mode="w")
-                    json.dump([], file)
-                    file.close()
-                except Exception as ex:
-                    print(_("Error creating file:"), ex)
-                    return Failure(str(ex))
-            self.documents[documentname] = Document(documentname)
-            self.documents[documentname].has_unsaved_changes = True
-        return self.documents[documentname]
+        document = self.documents.get(documentname)
+        if document is not None:
+            document.last_access = time.time()
+            return document
+        if documentname in self.loading:
+            d = defer.Deferred()
+            self.loading[documentname].append(d)
+            return d
+        if documentname in self.catalog:
+            if self.database:
+                return self.load_document_from_database(documentname)
+            return self.load_document_in_background(documentname)
+
+        document = Document(documentname)
+        if self.database:
+            try:
+                self.database.create_document(documentname)
+            except sqlite3.Error as ex:
+                print(_("Error creating document:"), ex)
+                return Failure(str(ex))
+            document.database = self.database
+            self.catalog[documentname] = (0, time.time())
+        elif self.autosave_interval > 0:
+            # Try to create a savefile, if it fails deny the document creation
+            try:
+                self.save_document(documentname, document)
+            except Exception as ex:
+                print(_("Error creating file:"), ex)
+                return Failure(str(ex))
+            self.open_operation_log(documentname, document)
+        self.documents[documentname] = document
+        return document
+
+    def load_document_in_background(self, name):
+        """
+        Load a saved document in a worker thread. The operations, which were
+        logged after its last snapshot was written, are replayed afterwards.
+
+        Positional arguments:
+        name -- Name of the document
+
+        Return value: A Deferred, which fires with the Document object
+        """
+        filename = os.path.join(self.autosave_directory, find_documents(self.autosave_directory, name)[name])
+        debug(2, _("Loading document '{}' from '{}'").format(name, filename))
+        waiting = self.loading[name] = []
+
+        def loaded(document):
+            del self.loading[name]
+            self.documents[name] = document
+            self.open_operation_log(name, document)
+            replayed = document.replay_operation_log()
+            if replayed > 0:
+                debug(1, _("Replayed {} logged operations on document '{}'").format(replayed, name))
+            if self.simplify_tolerance > 0:
+                removed = document.simplify(self.simplify_tolerance)
+                debug(2, _("Removed {} points from document '{}'").format(removed, name))
+            for d in waiting:
+                d.callback(document)
+            return document
+
+        def failed(failure):
+            del self.loading[name]
+            if failure.check(NewerFileFormatError):
+                failure = Failure(_("Could not load document '{}' because it was created with a newer version of cournal-server.").format(name))
+            print(_("ERROR: {}").format(failure.getErrorMessage()), file=sys.stderr)
+            for d in waiting:
+                d.errback(failure)
+            return failure
+
+        d = threads.deferToThread(load_document, filename, name)
+        d.addCallbacks(loaded, failed)
+        return d
+
+    def load_document_from_database(self, name):
+        """
+        Load a document stored in the database.
+
+        Positional arguments:
+        name -- Name of the document
+
+        Return value: The Document object or a Failure
+        """
+        debug(2, _("Loading document '{}' from the database").format(name))
+        try:
+            pages, oplog_seq = self.database.load_document(name)
+        except sqlite3.Error as ex:
+            print(_("Error loading document '{}': {}").format(name, ex), file=sys.stderr)
+            return Failure(str(ex))
+        document = Document(name, [Page(strokes) for strokes in pages], oplog_seq)
+        document.database = self.database
+        self.documents[name] = document
+        if self.simplify_tolerance > 0:
+            removed = document.simplify(self.simplify_tolerance)
+            debug(2, _("Removed {} points from document '{}'").format(removed, name))
+            if removed > 0:
+                self.database.write_document(document)
+                document.has_unsaved_changes = False
+        return document
+
+    def evict_documents(self):
+        """
+        Remove saved documents without users from memory. They are removed,
+        if they were not used for idle_timeout seconds, or if all documents need
+        more than max_memory bytes, starting with the least recently used one.
+        """
+        candidates = [document for document in self.documents.values()
+                      if not document.users and not document.has_unsaved_changes]
+        candidates.sort(key=lambda document: document.last_access)
+        now = time.time()
+        if self.max_memory > 0:
+            memory = sum(document.memory_usage() for document in self.documents.values())
+
+        for document in candidates:
+            if self.idle_timeout > 0 and now - document.last_access >= self.idle_timeout:
+                debug(2, _("Removing idle document '{}' from memory").format(document.name))
+            elif self.max_memory > 0 and memory > self.max_memory:
+                debug(2, _("Removing document '{}' from memory to stay below the memory limit").format(document.name))
+            else:
+                continue
+            if self.max_memory > 0:
+                memory -= document.memory_usage()
+            if document.oplog:
+                document.oplog.close()
+            del self.documents[document.name]
 
 
 @implementer(portal.IRealm)
@@ -362,7 +719,7 @@ def perspective_list_documents(self):
         """
         debug(2, _("User {} requested document list").format(self.name))
 
-        return list(self.server.documents.keys())
+        return list(set(self.server.catalog) | set(self.server.documents))
 
     def perspective_join_document(self, documentname):
         """
@@ -376,6 +733,19 @@ def perspective_join_document(self, documentname):
         document = self.server.get_document(documentname)
         if isinstance(document, Failure):
             return document
+        if isinstance(document, defer.Deferred):
+            return document.addCallback(self.join_document)
+        return self.join_document(document)
+
+    def join_document(self, document):
+        """
+        Start editing a document, that is in memory.
+
+        Positional arguments:
+        document -- The Document object
+
+        Return value: The Document object
+        """
         document.add_user(self)
         self.documents.append(document)
         return document
@@ -400,11 +770,13 @@ class Document(pb.Viewable):
     """
     A Cournal document, having multiple pages.
     """
-    def __init__(self, name, pages=None):
+    def __init__(self, name, pages=None, oplog_seq=0):
         """
         Arguments:
         name -- Name of this document
         pages -- List of Page objects (default  [])
+        oplog_seq -- Sequence number of the last logged operation, that is
+                     contained in the pages (default 0)
         """
         self.name = name
         self.users = []
@@ -412,23 +784,117 @@ def __init__(self, name, pages=None):
         if self.pages is None:
             self.pages = []
         self.has_unsaved_changes = False
+        self.oplog = None
+        self.oplog_seq = oplog_seq
+        # The SQLiteStorage, which receives all modifications instead of the
+        # operation log, if the document is stored in a database
+        self.database = None
+        # Time, when this document was requested or its last user left
+        self.last_access = time.time()
 
     def get_state_to_save(self):
         """Returns a subset of self.__dict__, which is to be stored on disk."""
-        return {"pages": self.pages}
+        return {"pages": self.pages, "oplog_seq": self.oplog_seq}
+
+    def snapshot(self):
+        """
+        Return a copy of this document, which can be saved, while this one is
+        modified. Strokes are never modified, so they are not copied.
+        """
+        return Document(self.name, [page.copy() for page in self.pages], self.oplog_seq)
+
+    def log_operation(self, method, *args):
+        """
+        Append a modification of this document to its operation log or database, if any.
+
+        Positional arguments:
+        method -- Name of the Document method, that applies the modification
+        *args -- Arguments of that method
+        """
+        self.oplog_seq += 1
+        if self.database:
+            self.database.log_operation(self.name, self.oplog_seq, method, args)
+        elif self.oplog:
+            record = [self.oplog_seq, method] + list(args)
+            self.oplog.append(json.dumps(record, cls=CournalLogEncoder))
+
+    def replay_operation_log(self):
+        """
+        Apply all logged operations, which are not yet contained in the pages
+        of this document.
+
+        Return value: Number of replayed operations
+        """
+        replayed = 0
+        for line in self.oplog.records():
+            seq, method, *args = json.loads(line, cls=CournalDecoder)
+            if seq <= self.oplog_seq:
+                continue
+            self.oplog_seq = seq
+            if method == "add_stroke":
+                self.add_stroke(*args)
+            elif method == "delete_stroke":
+                self.delete_stroke(*args)
+            else:
+                # e.g. "delete_stroke_with_coords", which was logged by older
+                # versions, before strokes had ids
+                print(_("WARNING: Skipped unknown operation '{}' in the log of document '{}'").format(method, self.name),
+                      file=sys.stderr)
+                continue
+            replayed += 1
+        if replayed > 0:
+            self.has_unsaved_changes = True
+        return replayed
+
+    def simplify(self, tolerance):
+        """
+        Simplify all strokes of this document. The simplified strokes are
+        written on the next autosave.
+
+        Positional arguments:
+        tolerance -- Maximum distance in pt between the old and the new strokes
+
+        Return value: Number of points, that were removed
+        """
+        removed = 0
+        for page in self.pages:
+            removed += simplify_strokes(page.strokes.values(), tolerance)
+        if removed > 0:
+            self.has_unsaved_changes = True
+        return removed
+
+    def memory_usage(self):
+        """Return a rough estimate of the memory needed by the strokes of this document in bytes."""
+        size = 0
+        for page in self.pages:
+            for stroke in page.strokes.values():
+                size += STROKE_OVERHEAD + 8 * len(stroke.coords)
+                if stroke.widths is not None:
+                    size += 8 * len(stroke.widths)
+        return size
 
     def add_user(self, user):
         """
         Called, when a user starts editing this document. Send him all strokes
-        that are currently in the document.
+        that are currently in the document, grouped by page in a few large
+        messages.
 
         Positional arguments:
         user -- The concerning User object.
         """
         self.users.append(user)
         for pagenum in range(len(self.pages)):
-            for stroke in self.pages[pagenum].strokes:
-                user.call_remote("new_stroke", pagenum, stroke)
+            chunk = []
+            num_coords = 0
+            for stroke in self.pages[pagenum].strokes.values():
+                chunk.append(stroke)
+                num_coords += len(stroke.coords)
+                if num_coords >= SYNC_CHUNK_SIZE:
+                    user.call_remote("new_strokes", pagenum, chunk)
+                    chunk = []
+                    num_coords = 0
+            if chunk:
+                user.call_remote("new_strokes", pagenum, chunk)
 
     def remove_user(self, user):
         """
@@ -438,6 +904,7 @@ def remove_user(self, user):
         user -- The concerning User object.
         """
         self.users.remove(user)
+        self.last_access = time.time()
 
     def broadcast(self, method, *args, except_user=None):
         """
@@ -463,17 +930,41 @@ def view_new_stroke(self, from_user, pagenum, stroke):
         from_user -- The User object of the initiating user.
         pagenum -- Page number the new stroke.
         stroke -- The new stroke
-        """
-        self.has_unsaved_changes = True
 
-        while len(self.pages) <= pagenum:
-            self.pages.append(Page())
-        self.pages[pagenum].strokes.append(stroke)
+        Return value: The id, that was assigned to the new stroke
+        """
+        # The server is the only one to assign stroke ids
+        stroke.id = None
+        self.add_stroke(pagenum, stroke)
+        self.log_operation("add_stroke", pagenum, stroke)
 
         debug(3, _("New stroke on page {}").format(pagenum + 1))
         self.broadcast("new_stroke", pagenum, stroke, except_user=from_user)
+        return stroke.id
+
+    def view_new_strokes(self, from_user, pagenum, strokes):
+        """
+        Broadcast many strokes received from one client at once to all other
+        clients. Called by clients to add many strokes (e.g. when importing a
+        document).
+
+        Positional arguments:
+        from_user -- The User object of the initiating user.
+        pagenum -- Page number of the new strokes.
+        strokes -- List of the new strokes
+
+        Return value: List of the ids, that were assigned to the new strokes
+        """
+        for stroke in strokes:
+            stroke.id = None
+            self.add_stroke(pagenum, stroke)
+            self.log_operation("add_stroke", pagenum, stroke)
+
+        debug(3, _("{} new strokes on page {}").format(len(strokes), pagenum + 1))
+        self.broadcast("new_strokes", pagenum, strokes, except_user=from_user)
+        return [stroke.id for stroke in strokes]
 
-    def view_delete_stroke_with_coords(self, from_user, pagenum, coords):
+    def view_delete_stroke(self, from_user, pagenum, stroke_id):
         """
         Broadcast the delete stroke command from one to all other clients.
         Called by Clients to delete a stroke.
@@ -481,16 +972,42 @@ def view_delete_stroke_with_coords(self, from_user, pagenum, coords):
         Positional arguments:
         from_user -- The User object of the initiating user.
         pagenum -- Page number the deleted stroke
-        coords -- The list coordinates of the deleted stroke
+        stroke_id -- The id of the deleted stroke
+        """
+        if self.delete_stroke(pagenum, stroke_id):
+            self.log_operation("delete_stroke", pagenum, stroke_id)
+
+            debug(3, _("Deleted stroke on page {}").format(pagenum + 1))
+            self.broadcast("delete_stroke", pagenum, stroke_id, except_user=from_user)
+
+    def add_stroke(self, pagenum, stroke):
+        """
+        Add a stroke to a page, creating the page if neccessary.
+
+        Positional arguments:
+        pagenum -- Page number the new stroke.
+        stroke -- The new stroke
         """
         self.has_unsaved_changes = True
 
-        for stroke in self.pages[pagenum].strokes:
-            if stroke.coords == coords:
-                self.pages[pagenum].strokes.remove(stroke)
+        while len(self.pages) <= pagenum:
+            self.pages.append(Page())
+        self.pages[pagenum].add_stroke(stroke)
+
+    def delete_stroke(self, pagenum, stroke_id):
+        """
+        Delete a stroke from a page.
+
+        Positional arguments:
+        pagenum -- Page number the deleted stroke
+        stroke_id -- The id of the deleted stroke
 
-                debug(3, _("Deleted stroke on page {}").format(pagenum + 1))
-                self.broadcast("delete_stroke_with_coords", pagenum, coords, except_user=from_user)
+        Return value: True, if a stroke was deleted
+        """
+        if pagenum >= len(self.pages) or not self.pages[pagenum].delete_stroke(stroke_id):
+            return False
+        self.has_unsaved_changes = True
+        return True
 
 
 class CmdlineParser:
@@ -503,6 +1020,10 @@ def __init__(self):
         self.autosave_directory = DEFAULT_AUTOSAVE_DIRECTORY
         self.autosave_interval = DEFAULT_AUTOSAVE_INTERVAL
         self.save_hook = None
+        self.simplify_tolerance = 0
+        self.idle_timeout = DEFAULT_IDLE_TIMEOUT
+        self.max_memory = 0
+        self.storage = "files"
 
     def parse(self):
         """
@@ -521,6 +1042,22 @@ def parse(self):
                             help=_("Script or application to execute after all documents were saved. "
                                    "The first argument is the autosave directory, "
                                    "followed by all filenames of files that were changed."))
+        parser.add_argument("--simplify", nargs=1, type=float, default=[self.simplify_tolerance],
+                            metavar="TOLERANCE",
+                            help=_("Remove unneeded points from all strokes of the saved documents, when they are loaded. "
+                                   "Strokes will not move by more than TOLERANCE pt."))
+        parser.add_argument("--idle-timeout", nargs=1, type=int, default=[self.idle_timeout],
+                            metavar="SECONDS",
+                            help=_("Remove documents without users from memory after they were saved and "
+                                   "not used for SECONDS. Set to 0 to keep them."))
+        parser.add_argument("--max-memory", nargs=1, type=int, default=[self.max_memory],
+                            metavar="MB",
+                            help=_("Remove the least recently used documents without users from memory, "
+                                   "while all documents need more than MB megabytes. Set to 0 for no limit."))
+        parser.add_argument("--storage", nargs=1, choices=["files", "sqlite"], default=[self.storage],
+                            help=_("Store every document in its own file or all documents in a SQLite database "
+                                   "in the autosave directory. Documents saved in files are copied into the "
+                                   "database on the first start with sqlite."))
         parser.add_argument("-v", "--version", action="version",
                             version="%(prog)s " + cournal_version)
         args = parser.parse_args()
@@ -528,16 +1065,114 @@ def parse(self):
         self.port = args.port[0]
         self.autosave_directory = args.autosave_directory[0]
         self.autosave_interval = args.autosave_interval[0]
+        self.simplify_tolerance = args.simplify[0]
+        self.idle_timeout = args.idle_timeout[0]
+        self.max_memory = args.max_memory[0] * 2**20
+        self.storage = args.storage[0]
         if args.save_hook:
             self.save_hook = args.save_hook[0]
         return self
 
 
+def write_document(filename, document, file_format_version=FILE_FORMAT_VERSION):
+    """
+    Save a document atomically. Version 1 of the file format is JSON and
+    written to "cnl-[documentname].json", version 2 is binary and written to
+    "cnl-[documentname].cnl". Files of the document in the other version are
+    removed afterwards.
+
+    Positional arguments:
+    filename -- Path of the file to write. Its extension must match the version.
+    document -- The Document object
+
+    Keyword arguments:
+    file_format_version -- Write the document in this version of the file
+                           format, 1 or 2 (defaults to FILE_FORMAT_VERSION)
+    """
+    directory, basename = os.path.split(filename)
+    stem = os.path.splitext(basename)[0]
+    # We write to a tmpfile and move it to the actual location to ensure
+    # atomic writing of the file, meaning: In case of a crash, either the
+    # old or the new version of that file is on the disk
+    tmpfile = NamedTemporaryFile(prefix=stem + '-', suffix='.delete-me', dir=directory, mode='wb', delete=False)
+    tmpfile.write(str(file_format_version).encode() + b'\n')
+    if file_format_version == 1:
+        text = TextIOWrapper(tmpfile, encoding="UTF-8")
+        codec.encode_document(document, text)
+        text.close()
+    else:
+        binaryformat.encode_document(document, tmpfile)
+        tmpfile.close()
+    os.rename(tmpfile.name, filename)
+    for version, extension in FILE_EXTENSIONS.items():
+        if version != file_format_version and os.path.exists(os.path.join(directory, stem + extension)):
+            os.remove(os.path.join(directory, stem + extension))
+
+
+def find_documents(directory, name=None):
+    """
+    Find the documents saved in a directory. If a document was saved in
+    several versions of the file format, the newest one is used.
+
+    Positional arguments:
+    directory -- Path of the directory
+
+    Keyword arguments:
+    name -- Only look for the document with this name (defaults to None)
+
+    Return value: A dict mapping names of documents to their filenames
+    """
+    if name is None:
+        filenames = os.listdir(directory)
+    else:
+        stem = os.path.splitext(docname_to_filename(name))[0]
+        filenames = [stem + extension for extension in FILE_EXTENSIONS.values()
+                     if os.path.exists(os.path.join(directory, stem + extension))]
+
+    result = dict()
+    versions = dict()
+    for filename in filenames:
+        extension = os.path.splitext(filename)[1]
+        if not filename.startswith("cnl-"):
+            continue
+        for version, candidate in FILE_EXTENSIONS.items():
+            if extension == candidate:
+                docname = filename_to_docname(filename)
+                if version > versions.get(docname, 0):
+                    result[docname] = filename
+                    versions[docname] = version
+    return result
+
+
+def load_document(filename, name):
+    """
+    Load a document, that was saved by cournal-server.
+
+    Positional arguments:
+    filename -- Path of the saved document
+    name -- Name of the document
+
+    Return value: The Document object
+
+    Raises NewerFileFormatError, if the file format is not supported.
+    """
+    with open(filename, "rb") as file:
+        file_format_version = int(file.readline())
+        if file_format_version > FILE_FORMAT_VERSION:
+            raise NewerFileFormatError(filename)
+        if file_format_version == 1:
+            pages, oplog_seq = codec.decode_document(TextIOWrapper(file, encoding="UTF-8"))
+        else:
+            pages, oplog_seq = binaryformat.decode_document(file)
+    return Document(name, [Page(strokes) for strokes in pages], oplog_seq)
+
+
 def filename_to_docname(filename):
     """
     Convert the filename of a saved document to a documentname. Filenames have the
-    form "cnl-[documentname].save" where [documentname] is the name of the
-    document with escaped special characters
+    form "cnl-[documentname].cnl" where [documentname] is the name of the
+    document with escaped special characters and the extension depends on the
+    file format
 
     Positional arguments:
     filename -- Name of the file with escaped special characters
@@ -545,7 +1180,7 @@ def filename_to_docname(filename):
     Return value: Name of the document without escaped special characters.
     """
     result = ""
-    input = StringIO(filename[4:-5])
+    input = StringIO(os.path.splitext(filename)[0][4:])
 
     while True:
         char = input.read(1)
@@ -561,15 +1196,19 @@ def filename_to_docname(filename):
     return result
 
 
-def docname_to_filename(name):
+def docname_to_filename(name, file_format_version=FILE_FORMAT_VERSION):
     """
     Convert the name of a document to a valid filename. Filenames have the
-    form "cnl-[documentname].save" where [documentname] is the name of the
+    form "cnl-[documentname].cnl" where [documentname] is the name of the
     document with escaped special characters.
 
     Positional arguments:
     name -- Name of the document without escaped special characters.
 
+    Keyword arguments:
+    file_format_version -- The extension of the filename is the one of this
+                           version of the file format (defaults to FILE_FORMAT_VERSION)
+
     Return value: Name of the file with escaped special characters
     """
     result = ""
@@ -580,7 +1219,20 @@ def docname_to_filename(name):
         else:
             result += ":" + hex(ord(char))[2:] + ";"
 
-    return "cnl-" + result + ".json"
+    return "cnl-" + result + FILE_EXTENSIONS[file_format_version]
+
+
+def docname_to_logname(name):
+    """
+    Convert the name of a document to the filename of its operation log, which
+    has the form "cnl-[documentname].log".
+
+    Positional arguments:
+    name -- Name of the document without escaped special characters.
+
+    Return value: Name of the file with escaped special characters
+    """
+    return os.path.splitext(docname_to_filename(name))[0] + ".log"
 
 
 def main():
@@ -596,7 +1248,8 @@ def main():
     port = args.port
 
     realm = CournalRealm()
-    realm.server = CournalServer(args.autosave_directory, args.autosave_interval, args.save_hook)
+    realm.server = CournalServer(args.autosave_directory, args.autosave_interval, args.save_hook,
+                                  args.simplify_tolerance, args.idle_timeout, args.max_memory, args.storage)
     atexit.register(realm.server.exit)
     checker = checkers.InMemoryUsernamePasswordDatabaseDontUse()
     checker.addUser(USERNAME.encode(), PASSWORD.encode())
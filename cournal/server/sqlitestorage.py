@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# This file is part of Cournal.
+# Copyright (C) 2012 Fabian Henze
+#
+# Cournal is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cournal is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cournal.  If not, see <http://www.gnu.org/licenses/>.
+
+import sqlite3
+import sys
+import time
+from array import array
+
+from twisted.internet import reactor
+
+from cournal.document.stroke import Stroke
+
+"""
+Storage of cournal-server documents in a SQLite database.
+
+Every stroke is a row, identified by its document, page and stroke id, so
+modifications are written as they arrive, instead of rewriting whole
+documents. Documents are loaded as a whole.
+"""
+
+# Maximum number of queued operations, before they are committed
+BATCH_SIZE = 500
+# Seconds, after which queued operations are committed
+COMMIT_DELAY = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    modified REAL NOT NULL,
+    oplog_seq INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS strokes (
+    document INTEGER NOT NULL REFERENCES documents (id) ON DELETE CASCADE,
+    page INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    color INTEGER NOT NULL,
+    linewidth REAL NOT NULL,
+    coords BLOB NOT NULL,
+    widths BLOB,
+    UNIQUE (document, page, id)
+);
+"""
+
+
+class SQLiteStorage:
+    """
+    A SQLite database holding many documents.
+
+    Operations on documents are queued by log_operation() and committed in
+    one transaction COMMIT_DELAY seconds after the first of them arrived, when
+    BATCH_SIZE of them are queued or when flush() is called.
+    The database is locked exclusively, as long as it is open, so no other
+    instance of cournal-server can use it at the same time.
+    """
+    def __init__(self, filename):
+        """
+        Constructor. Open the database and create the tables, if needed.
+
+        Positional arguments:
+        filename -- Path of the database file
+        """
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute("PRAGMA locking_mode = EXCLUSIVE")
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(_SCHEMA)
+        # Maps names of documents to their ids in the database
+        self.document_ids = dict(self.connection.execute("SELECT name, id FROM documents"))
+        # List of queued operations, each being a tuple of two: (SQL statement, parameters)
+        self.queue = []
+        # Maps ids of modified documents to the sequence number of their last operation
+        self.modified = dict()
+        # The pending call of commit_queued(), if any
+        self.commit_call = None
+
+    def close(self):
+        """Commit all queued operations and close the database."""
+        self.flush()
+        self.connection.close()
+
+    def catalog(self):
+        """
+        Return a dict mapping the names of all documents to a tuple of two:
+        (number of bytes used by their strokes, time of the last modification)
+        """
+        result = self.connection.execute(
+            "SELECT name, IFNULL(SUM(LENGTH(coords) + IFNULL(LENGTH(widths), 0)), 0), modified "
+            "FROM documents LEFT JOIN strokes ON strokes.document = documents.id GROUP BY documents.id")
+        return {name: (size, modified) for name, size, modified in result}
+
+    def create_document(self, name):
+        """
+        Add an empty document to the database.
+
+        Positional arguments:
+        name -- Name of the document
+        """
+        with self.connection:
+            cursor = self.connection.execute("INSERT INTO documents (name, modified) VALUES (?, ?)",
+                                             (name, time.time()))
+        self.document_ids[name] = cursor.lastrowid
+
+    def write_document(self, document):
+        """
+        Store a whole document, replacing the strokes saved for it before.
+
+        Positional arguments:
+        document -- The Document object of cournal-server
+        """
+        self.flush()
+        if document.name not in self.document_ids:
+            self.create_document(document.name)
+        document_id = self.document_ids[document.name]
+        with self.connection:
+            self.connection.execute("DELETE FROM strokes WHERE document = ?", (document_id,))
+            self.connection.executemany(
+                "INSERT INTO strokes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (_stroke_row(document_id, pagenum, stroke)
+                 for pagenum, page in enumerate(document.pages) for stroke in page.strokes.values()))
+            self.connection.execute("UPDATE documents SET modified = ?, oplog_seq = ? WHERE id = ?",
+                                    (time.time(), document.oplog_seq, document_id))
+
+    def load_document(self, name):
+        """
+        Read all strokes of a document.
+
+        Positional arguments:
+        name -- Name of the document
+
+        Return value: tuple of two: (list of pages, each being a list of Stroke
+                      objects, sequence number of the last operation)
+        """
+        self.flush()
+        document_id, oplog_seq = self.connection.execute(
+            "SELECT id, oplog_seq FROM documents WHERE name = ?", (name,)).fetchone()
+        pages = []
+        for row in self.connection.execute("SELECT page, id, color, linewidth, coords, widths FROM strokes "
+                                           "WHERE document = ? ORDER BY rowid", (document_id,)):
+            while len(pages) <= row[0]:
+                pages.append([])
+            pages[row[0]].append(_row_to_stroke(*row[1:]))
+        return pages, oplog_seq
+
+    def log_operation(self, name, seq, method, args):
+        """
+        Queue a modification of a document.
+
+        Positional arguments:
+        name -- Name of the document
+        seq -- Sequence number of the operation
+        method -- "add_stroke" or "delete_stroke"
+        args -- List of arguments of that method of Document
+        """
+        document_id = self.document_ids[name]
+        if method == "add_stroke":
+            pagenum, stroke = args
+            self.queue.append(("INSERT OR REPLACE INTO strokes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               _stroke_row(document_id, pagenum, stroke)))
+        elif method == "delete_stroke":
+            pagenum, stroke_id = args
+            self.queue.append(("DELETE FROM strokes WHERE document = ? AND page = ? AND id = ?",
+                               (document_id, pagenum, stroke_id)))
+        self.modified[document_id] = seq
+        if len(self.queue) >= BATCH_SIZE:
+            self.commit_queued()
+        elif self.commit_call is None:
+            self.commit_call = reactor.callLater(COMMIT_DELAY, self.commit_queued)
+
+    def commit_queued(self):
+        """Commit the queued operations and report errors."""
+        try:
+            self.flush()
+        except sqlite3.Error as ex:
+            # The operations stay queued and are written by the next flush()
+            print(_("Error writing to database '{}': {}").format(self.filename, ex), file=sys.stderr)
+
+    def flush(self):
+        """
+        Commit all queued operations in one transaction.
+
+        Return value: True, if anything was written
+        """
+        if self.commit_call is not None:
+            if self.commit_call.active():
+                self.commit_call.cancel()
+            self.commit_call = None
+        if not self.modified:
+            return False
+        queue, self.queue = self.queue, []
+        modified, self.modified = self.modified, dict()
+        now = time.time()
+        try:
+            with self.connection:
+                for statement, parameters in queue:
+                    self.connection.execute(statement, parameters)
+                self.connection.executemany("UPDATE documents SET modified = ?, oplog_seq = ? WHERE id = ?",
+                                            ((now, seq, document_id) for document_id, seq in modified.items()))
+        except sqlite3.Error:
+            # Keep the operations, so they are written on the next try
+            self.queue = queue
+            self.modified = modified
+            raise
+        return True
+
+
+def _stroke_row(document_id, pagenum, stroke):
+    """Return the row of the strokes table representing a stroke."""
+    red, green, blue, opacity = stroke.color
+    widths = None
+    if stroke.widths is not None:
+        widths = _pack_floats(stroke.widths)
+    return (document_id, pagenum, stroke.id, int(red) << 24 | int(green) << 16 | int(blue) << 8 | int(opacity),
+            stroke.linewidth, _pack_floats(stroke.coords), widths)
+
+
+def _row_to_stroke(stroke_id, color, linewidth, coords, widths):
+    """Create a Stroke from the columns of a row of the strokes table."""
+    color = [color >> 24 & 255, color >> 16 & 255, color >> 8 & 255, color & 255]
+    if widths is not None:
+        widths = _unpack_floats(widths)
+    return Stroke(color, linewidth, coords=_unpack_floats(coords), id=stroke_id, widths=widths)
+
+
+def _pack_floats(values):
+    """Return an array of floats as little endian doubles."""
+    floats = array("d", values)
+    if sys.byteorder == "big":
+        floats.byteswap()
+    return floats.tobytes()
+
+
+def _unpack_floats(data):
+    """Read little endian doubles into an array."""
+    floats = array("d")
+    floats.frombytes(data)
+    if sys.byteorder == "big":
+        floats.byteswap()
+    return floats
@@ -17,20 +17,33 @@
 # You should have received a copy of the GNU General Public License
 # along with Cournal.  If not, see <http://www.gnu.org/licenses/>.
 
+from bisect import bisect_right
+
 import cairo
-from gi.repository import Gtk, Gdk
+from gi.repository import Gtk, Gdk, GLib
 
 from cournal.viewer.pagewidget import PageWidget
+from cournal.viewer.renderer import Renderer
 
 PAGE_SEPARATOR = 10  # px
+# Number of pages above and below the visible ones, which get a PageWidget
+PAGE_MARGIN = 2
+# Memory in bytes, that rendered pages outside the visible area may occupy
+MEMORY_BUDGET = 128 * 1024 * 1024
+# Time in ms after the last zoom step, until pages are rendered in the new size
+ZOOM_SETTLE_DELAY = 300
 
 
 class Layout(Gtk.Layout):
     """
     The main pdf viewer/annotation widget containing one or more PageWidgets.
+
+    PageWidgets are only created for the pages near the visible area. The
+    vertical position of every page is kept in an offset table, so the layout
+    does not need a widget for each page to know its size.
     """
 
-    def __init__(self, document, **args):
+    def __init__(self, document, memory_budget=MEMORY_BUDGET, **args):
         """
         Constructor
 
@@ -38,20 +51,39 @@ def __init__(self, document, **args):
         document -- A Document object, containing the pages we want to render.
 
         Keyword arguments:
+        memory_budget -- Memory in bytes, that rendered pages outside the
+                         visible area may occupy (defaults to MEMORY_BUDGET)
         **args -- Arguments passed to the Gtk.Layout constructor
         """
         super().__init__(**args)
         self.document = document
-        self.children = []
+        self.memory_budget = memory_budget
+        # Maps page numbers to PageWidgets of the pages near the visible area
+        self.widgets = dict()
+        # offsets[i] is the y coordinate of page i, offsets[-1] is the height
+        # of all pages (including one PAGE_SEPARATOR)
+        self.offsets = [0]
+        self.page_width = 0
         self.zoomlevel = 1
+        # True, while the user is changing the zoomlevel. Pages are only scaled
+        # then, not rendered.
+        self.zooming = False
+        self._zoom_timeout = None
+        self._vadjustment = None
+        # Pages in the visible area
+        self.visible = range(0)
+        self.renderer = Renderer(document.pdfname)
+        # Update the offsets, when the real size of pages becomes known
+        document.sizes_changed_callback = self.on_page_sizes_changed
+        self._resize_idle = None
+        # True, if the offsets must be recalculated with the next allocation
+        self._offsets_dirty = False
 
         # The background color is visible between the PageWidgets
         self.override_background_color(Gtk.StateFlags.NORMAL, Gdk.RGBA(79 / 255, 78 / 255, 77 / 255, 1))
         self.connect("realize", self.set_cursor)
-
-        for page in self.document.pages:
-            self.children.append(PageWidget(page, self))
-            self.put(self.children[-1], 0, 0)
+        self.connect("notify::vadjustment", self.on_vadjustment_changed)
+        self.connect("destroy", self.on_destroy)
 
     def set_cursor(self, widget):
         """
@@ -72,6 +104,44 @@ def set_cursor(self, widget):
                                             cursor_pixbuf, width / 2, height / 2)
         widget.get_window().set_cursor(cursor)
 
+    def on_destroy(self, widget):
+        """Called, when the Layout is destroyed. Stop rendering pages."""
+        self.document.sizes_changed_callback = None
+        if self._resize_idle is not None:
+            GLib.source_remove(self._resize_idle)
+            self._resize_idle = None
+        if self._zoom_timeout is not None:
+            GLib.source_remove(self._zoom_timeout)
+            self._zoom_timeout = None
+        self.renderer.stop()
+
+    def on_page_sizes_changed(self):
+        """
+        Called, when the real size of pages became known. The offsets are
+        recalculated with the next allocation, which is queued from an idle
+        callback, as this may be called during an allocation.
+        """
+        self._offsets_dirty = True
+        if self._resize_idle is None:
+            self._resize_idle = GLib.idle_add(self._resize)
+
+    def _resize(self):
+        """Idle callback to queue a new allocation."""
+        self._resize_idle = None
+        self.queue_resize()
+        return False
+
+    def on_vadjustment_changed(self, widget, param):
+        """
+        Called, when the layout got a new vertical adjustment (e.g. from the
+        ScrolledWindow it was added to). Watch it to know the visible pages.
+        """
+        if self._vadjustment is not None:
+            self._vadjustment.disconnect_by_func(self.update_visible_pages)
+        self._vadjustment = self.get_vadjustment()
+        if self._vadjustment is not None:
+            self._vadjustment.connect("value-changed", self.update_visible_pages)
+
     def do_size_allocate(self, allocation):
         """
         Called, when the Layout is about to be resized. Resizes all children.
@@ -81,19 +151,21 @@ def do_size_allocate(self, allocation):
         """
         self.set_allocation(allocation)
 
-        new_width = allocation.width * self.zoomlevel
+        new_width = int(allocation.width * self.zoomlevel)
         old_width, old_height = self.get_size()
         adjustment = self.get_vadjustment()
 
-        if old_width != new_width:
-            new_height = 0
-            for child in self.children:
-                new_height += self.allocate_child(child, 0, new_height, new_width)
-                new_height += PAGE_SEPARATOR
-            new_height -= PAGE_SEPARATOR
-            # Preserve position when the window is resized.
-            adjustment.set_upper(adjustment.get_upper() * new_height / old_height)
-            adjustment.set_value(adjustment.get_value() * new_height / old_height)
+        if old_width != new_width or self._offsets_dirty:
+            self._offsets_dirty = False
+            self.update_offsets(new_width)
+            new_height = max(0, self.offsets[-1] - PAGE_SEPARATOR)
+            for number, child in self.widgets.items():
+                self.move(child, 0, self.offsets[number])
+                self.allocate_child(child, 0, self.offsets[number], new_width)
+            if old_width != new_width and old_height > 0:
+                # Preserve position when the window is resized.
+                adjustment.set_upper(adjustment.get_upper() * new_height / old_height)
+                adjustment.set_value(adjustment.get_value() * new_height / old_height)
         else:
             new_height = old_height
         self.set_size(new_width, new_height)
@@ -104,6 +176,142 @@ def do_size_allocate(self, allocation):
                                           allocation.width, allocation.height)
             self.get_bin_window().resize(new_width, max(allocation.height, new_height))
 
+        self.update_visible_pages()
+
+    def update_offsets(self, width):
+        """
+        Recalculate the position of all pages for a given width. Pages, whose
+        size is not yet known, get their estimated size.
+
+        Positional arguments:
+        width -- The width of every page in pixels
+        """
+        self.page_width = width
+        offsets = [0]
+        y = 0
+        get_page_size = self.document.get_page_size
+        for pagenum in range(self.document.num_of_pages):
+            page_width, page_height = get_page_size(pagenum)
+            y += int(width * page_height / page_width) + PAGE_SEPARATOR
+            offsets.append(y)
+        self.offsets = offsets
+
+    def get_page_offset(self, pagenum):
+        """
+        Return the y coordinate of a page in pixels.
+
+        Positional arguments:
+        pagenum -- Number of the page (starting with 0)
+        """
+        return self.offsets[pagenum]
+
+    def get_page_height(self, pagenum):
+        """
+        Return the height of a page in pixels.
+
+        Positional arguments:
+        pagenum -- Number of the page (starting with 0)
+        """
+        return self.offsets[pagenum + 1] - self.offsets[pagenum] - PAGE_SEPARATOR
+
+    def get_page_at_offset(self, y):
+        """
+        Return the number of the page at a y coordinate. The separator below a
+        page belongs to that page. Coordinates above the first or below the
+        last page belong to these pages.
+
+        Positional arguments:
+        y -- y coordinate in pixels
+        """
+        num_pages = len(self.offsets) - 1
+        return min(max(bisect_right(self.offsets, y) - 1, 0), max(num_pages - 1, 0))
+
+    def get_pages_in_range(self, top, bottom):
+        """
+        Return a range of the numbers of all pages between two y coordinates.
+
+        Positional arguments:
+        top -- Upper y coordinate in pixels
+        bottom -- Lower y coordinate in pixels
+        """
+        num_pages = len(self.offsets) - 1
+        first = self.get_page_at_offset(top)
+        last = min(bisect_right(self.offsets, bottom), num_pages)
+        return range(first, last)
+
+    def update_visible_pages(self, adjustment=None):
+        """
+        Create PageWidgets for the pages near the visible area and release
+        pages, which are far away.
+
+        Keyword arguments:
+        adjustment -- The vertical Gtk.Adjustment, that changed (unused)
+        """
+        adjustment = self.get_vadjustment()
+        if adjustment is None or self.page_width == 0:
+            return
+        top = adjustment.get_value()
+        visible = self.get_pages_in_range(top, top + adjustment.get_page_size())
+        self.visible = visible
+        num_pages = len(self.offsets) - 1
+        wanted = range(max(visible.start - PAGE_MARGIN, 0), min(visible.stop + PAGE_MARGIN, num_pages))
+
+        for number in wanted:
+            if number not in self.widgets:
+                child = PageWidget(self.document.pages[number], self)
+                self.widgets[number] = child
+                self.put(child, 0, self.offsets[number])
+                self.allocate_child(child, 0, self.offsets[number], self.page_width)
+                child.show()
+
+        # Release the pages farthest from the visible area first, until the
+        # pages outside the visible area fit into the memory budget. Pages
+        # outside the margin, which were never rendered, are removed anyway.
+        invisible = [number for number in self.widgets if number not in visible]
+        invisible.sort(key=lambda number: -min(abs(number - visible.start), abs(number - visible.stop)))
+        memory = sum(self.widgets[number].get_memory_usage() for number in invisible)
+        for number in invisible:
+            usage = self.widgets[number].get_memory_usage()
+            if memory > self.memory_budget:
+                memory -= usage
+                if number in wanted:
+                    self.widgets[number].release_buffers()
+                else:
+                    self.remove_page_widget(number)
+            elif usage == 0 and number not in wanted:
+                self.remove_page_widget(number)
+
+        # Render the visible pages first, then the ones closest to them
+        for child in self.widgets.values():
+            child.request_render()
+
+    def get_render_priority(self, pagenum):
+        """
+        Return the priority for rendering a page: 0 for visible pages,
+        otherwise the distance to the visible area in pages.
+
+        Positional arguments:
+        pagenum -- Number of the page
+        """
+        if pagenum < self.visible.start:
+            return self.visible.start - pagenum
+        elif pagenum >= self.visible.stop:
+            return pagenum - self.visible.stop + 1
+        return 0
+
+    def remove_page_widget(self, number):
+        """
+        Destroy the PageWidget of a page.
+
+        Positional arguments:
+        number -- Number of the page
+        """
+        child = self.widgets.pop(number)
+        self.renderer.cancel(number)
+        child.page.widget = None
+        self.remove(child)
+        child.destroy()
+
     def allocate_child(self, child, x, y, width):
         """
         Allocate space for a child widget
@@ -137,4 +345,23 @@ def set_zoomlevel(self, absolute=None, change=None):
         elif change:
             self.zoomlevel += change
         self.zoomlevel = min(max(self.zoomlevel, 0.2), 3)
+
+        # Show the pages scaled by cairo right away and render them in the
+        # new size, when the user stopped zooming for a moment.
+        self.zooming = True
+        if self._zoom_timeout is not None:
+            GLib.source_remove(self._zoom_timeout)
+        self._zoom_timeout = GLib.timeout_add(ZOOM_SETTLE_DELAY, self.zoom_settled)
         self.do_size_allocate(self.get_allocation())
+
+    def zoom_settled(self):
+        """
+        Called, when the zoomlevel was not changed for ZOOM_SETTLE_DELAY ms.
+        Render all pages in their new size.
+        """
+        self._zoom_timeout = None
+        self.zooming = False
+        for child in self.widgets.values():
+            child.queue_draw()
+        self.update_visible_pages()
+        return False
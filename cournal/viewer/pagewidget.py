@@ -17,11 +17,14 @@
 # You should have received a copy of the GNU General Public License
 # along with Cournal.  If not, see <http://www.gnu.org/licenses/>.
 
+from math import floor, ceil
+
 from gi.repository import Gtk, Gdk
 import cairo
 
 from cournal.viewer.tools import pen, eraser, navigation
 from cournal.document import search
+from cournal.document.stroke import draw_strokes
 
 
 class PageWidget(Gtk.DrawingArea):
@@ -46,10 +49,20 @@ def __init__(self, page, parent, **args):
         page.widget = self
         self.widget_width = 1
         self.widget_height = 1
+        # The rendered PDF page. It only changes, when the widget is resized.
+        # It is rendered in the background by the Renderer of the parent.
+        self.pdf_raster = None
+        # The PDF page with all strokes and the search marker on top of it
         self.backbuffer = None
         self.backbuffer_valid = True
+        # List of Gdk.Rectangles (in widget pixels), which need to be redrawn in
+        # the backbuffer, because something was deleted there
+        self.damage = []
         self.active_tool = None
-        self.preview_item = None
+        # An image drawn on top of the page (used by the pen tool to show the
+        # stroke, that is currently drawn) and the opacity to paint it with
+        self.overlay = None
+        self.overlay_alpha = 1
 
         self.set_events(Gdk.EventMask.BUTTON_PRESS_MASK |
                         Gdk.EventMask.BUTTON_RELEASE_MASK |
@@ -98,41 +111,183 @@ def draw(self, widget, context):
         """
         scaling = self.widget_width / self.page.width
 
-        # Check if the page has already been rendered in the correct size
-        if not self.backbuffer or self.backbuffer.get_width() != self.widget_width or self.backbuffer_valid is False:
+        if self.parent.zooming and self.backbuffer and not self.has_size(self.backbuffer):
+            # While the user is zooming, the old image is scaled by cairo. It
+            # is rendered in the new size once zooming settled.
+            self.paint_scaled(context, self.backbuffer)
+        else:
+            # Check if the PDF page has already been rendered in the correct size.
+            # If not, the old rendering is scaled (or a blank page is shown)
+            # until it is rendered.
+            if not self.pdf_raster or not self.has_size(self.pdf_raster):
+                self.request_render()
+
+            if not self.backbuffer or not self.has_size(self.backbuffer) or self.backbuffer_valid is False:
+                self.render_annotations(scaling)
+            elif self.damage:
+                self.repair_damage(scaling)
+
+            context.set_source_surface(self.backbuffer, 0, 0)
+            context.paint()
+
+        if self.overlay:
+            context.set_source_surface(self.overlay, 0, 0)
+            context.paint_with_alpha(self.overlay_alpha)
+
+    def has_size(self, surface):
+        """Return True, if a cairo.ImageSurface has the size of this widget."""
+        return surface.get_width() == self.widget_width and surface.get_height() == self.widget_height
+
+    def request_render(self):
+        """
+        Ask the renderer of the parent Layout to render the PDF page in the
+        current size, unless it already is.
+        """
+        if self.parent.zooming or (self.pdf_raster and self.has_size(self.pdf_raster)):
+            return
+        self.parent.renderer.request(self.page.number, self.widget_width, self.widget_height,
+                                     self.parent.get_render_priority(self.page.number),
+                                     self.pdf_rendered)
+
+    def pdf_rendered(self, surface):
+        """
+        Called, when the renderer finished rendering the PDF page.
+
+        Positional arguments:
+        surface -- A cairo.ImageSurface containing the PDF page on white
+        """
+        if not self.has_size(surface):
+            return
+        self.pdf_raster = surface
+        self.backbuffer_valid = False
+        self.queue_draw()
+
+    def paint_scaled(self, context, surface):
+        """
+        Paint an image scaled to the size of this widget.
+
+        Positional arguments:
+        context -- A cairo context without transformation
+        surface -- The cairo.ImageSurface to paint
+        """
+        context.save()
+        context.scale(self.widget_width / surface.get_width(), self.widget_height / surface.get_height())
+        context.set_source_surface(surface, 0, 0)
+        context.get_source().set_filter(cairo.FILTER_FAST)
+        context.set_operator(cairo.OPERATOR_SOURCE)
+        context.paint()
+        context.restore()
+
+    def paint_pdf(self, context):
+        """
+        Paint the cached PDF page (scaled, if it was rendered for a different
+        size) or a blank page, if it is not yet rendered.
+
+        Positional arguments:
+        context -- A cairo context on the backbuffer without transformation
+        """
+        if self.pdf_raster:
+            self.paint_scaled(context, self.pdf_raster)
+        else:
+            context.set_source_rgb(1, 1, 1)
+            context.set_operator(cairo.OPERATOR_SOURCE)
+            context.paint()
+            context.set_operator(cairo.OPERATOR_OVER)
+
+    def render_annotations(self, scaling):
+        """
+        Compose the cached PDF page, all strokes and the search marker
+        into self.backbuffer.
+
+        Positional arguments:
+        scaling -- Scaling factor between PDF coordinates and widget pixels
+        """
+        if not self.backbuffer or not self.has_size(self.backbuffer):
             self.backbuffer = cairo.ImageSurface(
                 cairo.FORMAT_ARGB32, self.widget_width, self.widget_height)
-            self.backbuffer_valid = True
-            bb_ctx = cairo.Context(self.backbuffer)
-
-            # For correct rendering of PDF, the PDF is first rendered to a
-            # transparent image (all alpha = 0).
-            bb_ctx.scale(scaling, scaling)
-            bb_ctx.save()
-            self.page.pdf.render(bb_ctx)
-            bb_ctx.restore()
-
-            for stroke in self.page.layers[0].strokes:
-                stroke.draw(bb_ctx, scaling)
-
-            # Highlight search result
-            if self.page.search_marker:
-                search.draw(bb_ctx, self.page)
-
-            # Then the image is painted on top of a white "page". Instead of
-            # creating a second image, painting it white, then painting the
-            # PDF image over it we can use the cairo.OPERATOR_DEST_OVER
-            # operator to achieve the same effect with the one image.
-            bb_ctx.set_operator(cairo.OPERATOR_DEST_OVER)
-            bb_ctx.set_source_rgb(1, 1, 1)
-            bb_ctx.paint()
-
-        context.set_source_surface(self.backbuffer, 0, 0)
-        context.paint()
+        self.backbuffer_valid = True
+        self.damage = []
+        context = cairo.Context(self.backbuffer)
+        self.paint_pdf(context)
 
-        if self.preview_item:
-            context.scale(scaling, scaling)
-            self.preview_item.draw(context, scaling)
+        context.scale(scaling, scaling)
+        draw_strokes(context, self.page.layers[0].strokes, scaling)
+
+        # Highlight search result
+        if self.page.search_marker:
+            search.draw(context, self.page)
+
+    def repair_damage(self, scaling):
+        """
+        Redraw the damaged parts of self.backbuffer: Paint the cached PDF page
+        and redraw all strokes intersecting the damaged area. All damage, that
+        accumulated since the last frame, is repaired at once.
+
+        Positional arguments:
+        scaling -- Scaling factor between PDF coordinates and widget pixels
+        """
+        context = cairo.Context(self.backbuffer)
+        for rect in self.damage:
+            context.rectangle(rect.x, rect.y, rect.width, rect.height)
+        context.clip()
+        self.paint_pdf(context)
+
+        context.scale(scaling, scaling)
+        index = self.page.layers[0].index
+        candidates = set()
+        for rect in self.damage:
+            candidates.update(index.query_rect(rect.x / scaling, rect.y / scaling,
+                                               (rect.x + rect.width) / scaling,
+                                               (rect.y + rect.height) / scaling))
+        if candidates:
+            # Keep the order, in which the strokes are drawn
+            draw_strokes(context, [stroke for stroke in self.page.layers[0].strokes
+                                   if stroke in candidates], scaling)
+
+        if self.page.search_marker:
+            search.draw(context, self.page)
+        self.damage = []
+
+    def add_damage(self, x1, y1, x2, y2):
+        """
+        Mark a part of the widget to be redrawn from scratch with the next frame.
+
+        Positional arguments:
+        x1, y1, x2, y2 -- Corners of the damaged rectangle in PDF coordinates
+        """
+        if not self.backbuffer:
+            return
+        if not self.has_size(self.backbuffer):
+            self.backbuffer_valid = False
+            return
+        scaling = self.widget_width / self.page.width
+        rect = Gdk.Rectangle()
+        # Add some pixels for antialiasing
+        rect.x = floor(min(x1, x2) * scaling) - 2
+        rect.y = floor(min(y1, y2) * scaling) - 2
+        rect.width = ceil(max(x1, x2) * scaling) + 2 - rect.x
+        rect.height = ceil(max(y1, y2) * scaling) + 2 - rect.y
+        self.damage.append(rect)
+        if self.get_window():
+            self.get_window().invalidate_rect(rect, False)
+
+    def get_memory_usage(self):
+        """Return the number of bytes used by the rendered images of this page."""
+        usage = 0
+        for surface in (self.pdf_raster, self.backbuffer):
+            if surface:
+                usage += surface.get_stride() * surface.get_height()
+        return usage
+
+    def release_buffers(self):
+        """
+        Free the rendered images of this page. They are rendered again, when the
+        page needs to be drawn.
+        """
+        self.parent.renderer.cancel(self.page.number)
+        self.pdf_raster = None
+        self.backbuffer = None
+        self.damage = []
 
     def press(self, widget, event):
         """
@@ -179,12 +334,28 @@ def draw_remote_stroke(self, stroke):
         Positional arguments:
         stroke -- The Stroke object, which is to be drawn.
         """
-        if self.backbuffer:
+        self.draw_remote_strokes([stroke])
+
+    def draw_remote_strokes(self, strokes):
+        """
+        Draw many strokes on the widget and update the affected area at once.
+
+        Positional arguments:
+        strokes -- List of Stroke objects, which are to be drawn.
+        """
+        if self.backbuffer and not self.has_size(self.backbuffer):
+            # It is rendered again in the correct size anyway
+            self.backbuffer_valid = False
+        elif self.backbuffer and strokes:
             scaling = self.widget_width / self.page.width
             context = cairo.Context(self.backbuffer)
 
             context.scale(scaling, scaling)
-            x, y, x2, y2 = stroke.draw(context, scaling)
+            x, y, x2, y2 = strokes[0].draw(context, scaling)
+            for stroke in strokes[1:]:
+                s_x, s_y, s_x2, s_y2 = stroke.draw(context, scaling)
+                x, y = min(x, s_x), min(y, s_y)
+                x2, y2 = max(x2, s_x2), max(y2, s_y2)
 
             update_rect = Gdk.Rectangle()
             update_rect.x = x - 2
@@ -198,34 +369,35 @@ def delete_remote_stroke(self, stroke):
         """
         Rerender the part of the widget, where a stroke was deleted
         Meant do be called by networking code, when a remote user deleted a stroke.
+        Only the strokes intersecting the bounding box of the deleted stroke are
+        redrawn, the PDF page is taken from self.pdf_raster.
 
         Positional arguments:
         stroke -- The Stroke object, which was deleted.
         """
-        if self.backbuffer:
-            self.backbuffer_valid = False
-            if self.get_window():
-                self.get_window().invalidate_rect(None, False)
+        coords = stroke.coords
+        margin = stroke.linewidth / 2
+        self.add_damage(min(coords[0::2]) - margin, min(coords[1::2]) - margin,
+                        max(coords[0::2]) + margin, max(coords[1::2]) + margin)
 
-    def draw_search_marker(self, rect):
+    def draw_search_marker(self):
         """
-        Draw the search marker on the widget
-
-        Positional arguments:
-        rect -- The rect marking the found search text
+        Draw the search marker (self.page.search_marker) on the widget
         """
-        self.page.search_marker = rect.x1, self.page.height - rect.y1, rect.x2, self.page.height - rect.y2
-        if self.backbuffer:
+        if self.backbuffer and not self.has_size(self.backbuffer):
+            self.backbuffer_valid = False
+        elif self.backbuffer:
             scaling = self.widget_width / self.page.width
             context = cairo.Context(self.backbuffer)
 
             context.scale(scaling, scaling)
             search.draw(context, self.page)
+            x1, y1, x2, y2 = self.page.search_marker
             update_rect = Gdk.Rectangle()
-            update_rect.x = rect.x1 * scaling
-            update_rect.y = (self.page.height - rect.y2) * scaling
-            update_rect.width = (rect.x2 - rect.x1) * scaling
-            update_rect.height = (rect.y2 - rect.y1) * scaling
+            update_rect.x = x1 * scaling
+            update_rect.y = y2 * scaling
+            update_rect.width = (x2 - x1) * scaling
+            update_rect.height = (y1 - y2) * scaling
 
             if self.get_window():
                 self.get_window().invalidate_rect(update_rect, False)
@@ -234,8 +406,6 @@ def delete_search_marker(self):
         """
         Rerender the part of the widget, where the marker was deleted
         """
+        if self.page.search_marker:
+            self.add_damage(*self.page.search_marker)
         self.page.search_marker = None
-        if self.backbuffer:
-            self.backbuffer_valid = False
-            if self.get_window():
-                self.get_window().invalidate_rect(None, False)
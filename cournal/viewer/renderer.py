@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# This file is part of Cournal.
+# Copyright (C) 2012 Fabian Henze
+#
+# Cournal is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cournal is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cournal.  If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+import threading
+from itertools import count
+
+from gi.repository import GLib, Poppler
+import cairo
+
+"""
+Rasterization of PDF pages in a background thread.
+"""
+
+
+class _RenderJob:
+    """A request to render one page in a given size."""
+    def __init__(self, pagenum, width, height, priority, callback):
+        self.pagenum = pagenum
+        self.width = width
+        self.height = height
+        self.priority = priority
+        self.callback = callback
+        self.cancelled = False
+        self.started = False
+
+
+class Renderer:
+    """
+    Renders PDF pages into cairo.ImageSurfaces in a worker thread, so the Gtk
+    main loop stays responsive.
+
+    Jobs with a lower priority value are rendered first. There is at most one
+    job per page: requesting a page again replaces the older job.
+    The worker uses its own Poppler.Document, as Poppler documents must not be
+    used by several threads at once.
+    """
+    def __init__(self, pdfname):
+        """
+        Constructor
+
+        Positional arguments:
+        pdfname -- The filename of the PDF document
+        """
+        self.pdfname = pdfname
+        # Heap of (priority, sequence number, job). Jobs, which were cancelled
+        # or got a new priority, remain in the heap and are skipped later.
+        self.queue = []
+        # Maps page numbers to their pending job
+        self.jobs = dict()
+        self.condition = threading.Condition()
+        self.sequence = count()
+        self.stopped = False
+        self.thread = None
+
+    def request(self, pagenum, width, height, priority, callback):
+        """
+        Render a page in the background.
+
+        Positional arguments:
+        pagenum -- Number of the page
+        width -- Width of the rendered image in pixels
+        height -- Height of the rendered image in pixels
+        priority -- Pages with a lower value are rendered first
+        callback -- Called in the main thread with the cairo.ImageSurface as
+                    argument, when the page was rendered
+        """
+        with self.condition:
+            job = self.jobs.get(pagenum)
+            if job and job.width == width and job.height == height:
+                job.callback = callback
+                self._set_priority(job, priority)
+                return
+            if job:
+                job.cancelled = True
+            job = _RenderJob(pagenum, width, height, priority, callback)
+            self.jobs[pagenum] = job
+            heapq.heappush(self.queue, (priority, next(self.sequence), job))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def _set_priority(self, job, priority):
+        """Push a job with a changed priority again. Lock must be held."""
+        if job.priority != priority and not job.started:
+            job.priority = priority
+            heapq.heappush(self.queue, (priority, next(self.sequence), job))
+
+    def cancel(self, pagenum):
+        """
+        Cancel the pending job of a page, if any.
+
+        Positional arguments:
+        pagenum -- Number of the page
+        """
+        with self.condition:
+            job = self.jobs.pop(pagenum, None)
+            if job:
+                job.cancelled = True
+
+    def stop(self):
+        """Cancel all jobs and terminate the worker thread."""
+        with self.condition:
+            self.stopped = True
+            for job in self.jobs.values():
+                job.cancelled = True
+            self.jobs.clear()
+            self.condition.notify()
+
+    def _next_job(self):
+        """Wait for the job with the lowest priority value. Lock must be held."""
+        while not self.stopped:
+            while self.queue:
+                priority, sequence, job = heapq.heappop(self.queue)
+                if not job.cancelled and not job.started and priority == job.priority:
+                    job.started = True
+                    return job
+            self.condition.wait()
+        return None
+
+    def _run(self):
+        """Main function of the worker thread."""
+        uri = GLib.filename_to_uri(self.pdfname, None)
+        pdf = Poppler.Document.new_from_file(uri, None)
+
+        while True:
+            with self.condition:
+                job = self._next_job()
+            if job is None:
+                return
+            surface = render_page(pdf.get_page(job.pagenum), job.width, job.height)
+            GLib.idle_add(self._finished, job, surface)
+
+    def _finished(self, job, surface):
+        """Called in the main thread, when a job is done."""
+        with self.condition:
+            if job.cancelled:
+                return False
+            del self.jobs[job.pagenum]
+        job.callback(surface)
+        return False
+
+
+def render_page(pdfpage, width, height):
+    """
+    Render a PDF page on a white background.
+
+    Positional arguments:
+    pdfpage -- The Poppler.Page to render
+    width -- Width of the image in pixels
+    height -- Height of the image in pixels
+
+    Return value: A cairo.ImageSurface
+    """
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    context = cairo.Context(surface)
+    scaling = width / pdfpage.get_size()[0]
+
+    # For correct rendering of PDF, the PDF is first rendered to a
+    # transparent image (all alpha = 0).
+    context.scale(scaling, scaling)
+    context.save()
+    pdfpage.render(context)
+    context.restore()
+
+    # Then the image is painted on top of a white "page". Instead of
+    # creating a second image, painting it white, then painting the
+    # PDF image over it we can use the cairo.OPERATOR_DEST_OVER
+    # operator to achieve the same effect with the one image.
+    context.set_operator(cairo.OPERATOR_DEST_OVER)
+    context.set_source_rgb(1, 1, 1)
+    context.paint()
+    return surface
@@ -22,11 +22,16 @@
 
 """
 A pen tool. Draws a stroke with a certain color and size.
+
+While drawing, each new segment of the stroke is drawn into an overlay image of
+the PageWidget, so the time needed to draw it does not depend on the length of
+the stroke.
 """
 
 _last_point = None
 _current_coords = None
 _current_stroke = None
+_overlay_context = None
 linewidth = 1.5
 color = (0, 0, 128, 255)
 
@@ -39,11 +44,24 @@ def press(widget, event):
     widget -- The PageWidget, which triggered the event
     event -- The Gdk.Event, which stores the location of the pointer
     """
-    global _last_point, _current_coords, _current_stroke, linewidth, color
+    global _last_point, _current_coords, _current_stroke, _overlay_context, linewidth, color
 
     _current_stroke = widget.page.new_unfinished_stroke(color=color, linewidth=linewidth)
     _current_coords = _current_stroke.coords
-    widget.preview_item = _current_stroke
+
+    # The segments are drawn opaque and the overlay is painted with the
+    # opacity of the stroke. This way, overlapping segments don't get darker.
+    r, g, b, opacity = color
+    widget.overlay = cairo.ImageSurface(cairo.FORMAT_ARGB32, widget.widget_width, widget.widget_height)
+    widget.overlay_alpha = opacity / 255
+    scaling = widget.widget_width / widget.page.width
+    _overlay_context = cairo.Context(widget.overlay)
+    _overlay_context.scale(scaling, scaling)
+    _overlay_context.set_source_rgb(r / 255, g / 255, b / 255)
+    _overlay_context.set_antialias(cairo.ANTIALIAS_GRAY)
+    _overlay_context.set_line_join(cairo.LINE_JOIN_ROUND)
+    _overlay_context.set_line_cap(cairo.LINE_CAP_ROUND)
+    _overlay_context.set_line_width(linewidth)
 
     _last_point = [event.x, event.y]
     motion(widget, event)
@@ -60,13 +78,17 @@ def motion(widget, event):
     global _last_point, _current_coords
 
     update_rect = Gdk.Rectangle()
-    scaling = widget.backbuffer.get_width() / widget.page.width
+    scaling = widget.widget_width / widget.page.width
 
     x = min(_last_point[0], event.x) - linewidth * scaling / 2
     y = min(_last_point[1], event.y) - linewidth * scaling / 2
     x2 = max(_last_point[0], event.x) + linewidth * scaling / 2
     y2 = max(_last_point[1], event.y) + linewidth * scaling / 2
 
+    _overlay_context.move_to(_last_point[0] / scaling, _last_point[1] / scaling)
+    _overlay_context.line_to(event.x / scaling, event.y / scaling)
+    _overlay_context.stroke()
+
     update_rect.x = x - 2
     update_rect.y = y - 2
     update_rect.width = x2 - x + 4
@@ -74,7 +96,7 @@ def motion(widget, event):
     widget.get_window().invalidate_rect(update_rect, False)
 
     _last_point = [event.x, event.y]
-    _current_coords.append([event.x / scaling, event.y / scaling])
+    _current_coords.extend((event.x / scaling, event.y / scaling))
 
 
 def release(widget, event):
@@ -86,10 +108,10 @@ def release(widget, event):
 
     Positional arguments: see press()
     """
-    global _last_point, _current_coords, _current_stroke
+    global _last_point, _current_coords, _current_stroke, _overlay_context
     try:
         widget.page.finish_stroke(_current_stroke)
-        widget.preview_item = None
+        widget.overlay = None
 
         context = cairo.Context(widget.backbuffer)
         scaling = widget.backbuffer.get_width() / widget.page.width
@@ -102,3 +124,4 @@ def release(widget, event):
     _last_point = None
     _current_coords = None
     _current_stroke = None
+    _overlay_context = None
@@ -74,7 +74,7 @@ class build(distutils.command.build.build):
         "For more information see http://cournal-project.org/"),
 
     packages=packages,
-    scripts=["cournal.py", "cournal-server.py"],
+    scripts=["cournal.py", "cournal-server.py", "cournal-batch.py"],
     package_data={"cournal": ["mainwindow.glade", "connectiondialog.glade", "document_chooser.glade"]},
     data_files=[
         ("share/icons/hicolor/16x16/apps/", ["icons/hicolor/16x16/apps/cournal.png"]),